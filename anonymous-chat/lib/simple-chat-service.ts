@@ -12,6 +12,7 @@ export interface ChatMessage {
 export interface SimpleChatServiceConfig {
   producerUrl: string;
   consumerUrl: string;
+  room: string;
   onMessage?: (message: ChatMessage) => void;
   onConnect?: () => void;
   onDisconnect?: () => void;
@@ -24,6 +25,9 @@ export class SimpleChatService {
   private reconnectAttempts = 0;
   private maxReconnectAttempts = 5;
   private reconnectDelay = 1000;
+  // Last chat message seen; reconnects ask the server to replay what came after it
+  private lastMessageId: string | null = null;
+  private historyOnJoin = 50;
 
   constructor(config: Partial<SimpleChatServiceConfig> = {}) {
     this.config = {
@@ -31,6 +35,7 @@ export class SimpleChatService {
         process.env.NEXT_PUBLIC_PRODUCER_URL || "http://localhost:8001",
       consumerUrl:
         process.env.NEXT_PUBLIC_CONSUMER_URL || "http://localhost:8002",
+      room: process.env.NEXT_PUBLIC_TOPIC_NAME || "anonymous-anime-universe",
       ...config,
     };
   }
@@ -42,7 +47,15 @@ export class SimpleChatService {
 
     try {
       // Connect to WebSocket for real-time messages
-      const wsUrl = this.config.consumerUrl!.replace("http", "ws") + "/ws/chat";
+      const query =
+        `?room=${encodeURIComponent(this.config.room)}` +
+        (this.lastMessageId
+          ? `&since=${encodeURIComponent(this.lastMessageId)}`
+          : `&history=${this.historyOnJoin}`) +
+        // Bursts arrive as one chat_batch frame instead of a frame per message
+        "&batch=1";
+      const wsUrl =
+        this.config.consumerUrl!.replace("http", "ws") + "/ws/chat" + query;
       console.log("🔗 WebSocket URL:", wsUrl);
       this.ws = new WebSocket(wsUrl);
 
@@ -59,17 +72,11 @@ export class SimpleChatService {
 
           // Handle different message types
           if (data.type === "chat_message") {
-            // Convert to chat message format
-            const message: ChatMessage = {
-              id: data.message_id || `msg_${Date.now()}`,
-              username: data.username,
-              text: data.text,
-              timestamp: data.timestamp,
-              room: data.room,
-              type: data.type,
-              active_connections: data.active_connections,
-            };
-            this.config.onMessage?.(message);
+            this.emitChatMessage(data, data.active_connections);
+          } else if (data.type === "chat_batch") {
+            for (const item of data.messages) {
+              this.emitChatMessage(item, data.active_connections);
+            }
           } else if (data.type === "connection_update") {
             // Handle connection status updates
             const message: ChatMessage = {
@@ -108,6 +115,23 @@ export class SimpleChatService {
     }
   }
 
+  private emitChatMessage(data: any, activeConnections?: number): void {
+    if (data.message_id) {
+      this.lastMessageId = data.message_id;
+    }
+    // Convert to chat message format
+    const message: ChatMessage = {
+      id: data.message_id || `msg_${Date.now()}`,
+      username: data.username,
+      text: data.text,
+      timestamp: data.timestamp,
+      room: data.room,
+      type: "chat_message",
+      active_connections: activeConnections,
+    };
+    this.config.onMessage?.(message);
+  }
+
   private attemptReconnect(): void {
     if (this.reconnectAttempts < this.maxReconnectAttempts) {
       this.reconnectAttempts++;
@@ -129,8 +153,7 @@ export class SimpleChatService {
   async sendMessage(
     username: string,
     text: string,
-    room: string = process.env.NEXT_PUBLIC_TOPIC_NAME ||
-      "anonymous-anime-universe"
+    room: string = this.config.room
   ): Promise<boolean> {
     try {
       const response = await fetch(`${this.config.producerUrl}/chat/send`, {
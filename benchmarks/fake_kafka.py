@@ -0,0 +1,397 @@
+"""
+In-process stand-in for confluent_kafka.Producer/Consumer.
+
+The fake broker keeps every topic in memory, assigns partitions the way the
+real client does (explicit partition, else key hash, else round-robin) and
+acknowledges produced messages after a configurable latency. It implements
+the subset of the client API the servers use, so benchmarks can drive the
+real FastAPI apps without a Kafka cluster. Call install() before importing
+the servers.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import confluent_kafka
+from confluent_kafka import KafkaError, TopicPartition
+
+OFFSET_BEGINNING = confluent_kafka.OFFSET_BEGINNING
+OFFSET_END = confluent_kafka.OFFSET_END
+OFFSET_STORED = confluent_kafka.OFFSET_STORED
+OFFSET_INVALID = confluent_kafka.OFFSET_INVALID
+
+
+class FakeMessage:
+    """Mirrors confluent_kafka.Message accessors."""
+
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_headers",
+                 "_timestamp", "_error")
+
+    def __init__(self, topic, partition, offset, key, value, headers=None,
+                 timestamp=None, error=None):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._headers = headers
+        self._timestamp = timestamp if timestamp is not None else int(time.time() * 1000)
+        self._error = error
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+    def set_headers(self, headers):
+        self._headers = headers
+
+    def timestamp(self):
+        return (confluent_kafka.TIMESTAMP_CREATE_TIME, self._timestamp)
+
+    def error(self):
+        return self._error
+
+    def __len__(self):
+        return len(self._value) if self._value is not None else 0
+
+
+class _Metadata:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class FakeBroker:
+    """Topic/partition logs, committed group offsets and delivery timing."""
+
+    def __init__(self, partitions: int = 3, ack_latency: float = 0.0):
+        self.default_partitions = partitions
+        self.ack_latency = ack_latency
+        self.logs: Dict[str, List[List[FakeMessage]]] = {}
+        self.committed: Dict[Tuple[str, str, int], int] = {}
+        self.cond = threading.Condition()
+        self._round_robin = itertools.count()
+
+    def create_topic(self, topic: str, partitions: Optional[int] = None):
+        with self.cond:
+            return self._topic(topic, partitions)
+
+    def _topic(self, topic: str, partitions: Optional[int] = None):
+        log = self.logs.get(topic)
+        if log is None:
+            log = self.logs[topic] = [[] for _ in range(partitions or self.default_partitions)]
+        return log
+
+    def _pick_partition(self, log, key, partition):
+        if partition is not None and partition >= 0:
+            if partition >= len(log):
+                raise confluent_kafka.KafkaException(KafkaError(KafkaError._UNKNOWN_PARTITION))
+            return partition
+        if key is not None:
+            return zlib.crc32(key) % len(log)
+        return next(self._round_robin) % len(log)
+
+    def append(self, topic: str, value: bytes, key: Optional[bytes] = None,
+               partition: Optional[int] = None, headers=None, timestamp=None) -> FakeMessage:
+        """Write a record directly (as another producer would) and wake consumers."""
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self.cond:
+            log = self._topic(topic)
+            p = self._pick_partition(log, key, partition)
+            msg = FakeMessage(topic, p, len(log[p]), key, value, headers, timestamp)
+            log[p].append(msg)
+            self.cond.notify_all()
+        return msg
+
+    def metadata(self, topic: Optional[str] = None):
+        with self.cond:
+            names = [topic] if topic else list(self.logs)
+            topics = {}
+            for name in names:
+                log = self._topic(name)
+                topics[name] = _Metadata(
+                    topic=name,
+                    partitions={p: _Metadata(id=p, leader=1) for p in range(len(log))},
+                    error=None,
+                )
+        return _Metadata(topics=topics, brokers={1: _Metadata(id=1, host="fake", port=9092)},
+                         cluster_id="fake-cluster", controller_id=1)
+
+
+broker = FakeBroker()
+
+
+class FakeProducer:
+    """Producer whose deliveries are acknowledged after broker.ack_latency."""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = dict(config)
+        self._pending: List[Tuple[float, int, Any, FakeMessage]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def produce(self, topic, value=None, key=None, partition=-1, on_delivery=None,
+                callback=None, headers=None, timestamp=0, **kwargs):
+        cb = on_delivery or callback
+        if isinstance(headers, dict):
+            headers = list(headers.items())
+        msg = broker.append(topic, value, key, partition if partition != -1 else None,
+                            headers, timestamp or None)
+        due = time.monotonic() + broker.ack_latency
+        with self._cond:
+            heapq.heappush(self._pending, (due, next(self._seq), cb, msg))
+            self._cond.notify()
+
+    def poll(self, timeout: Optional[float] = None) -> int:
+        deadline = time.monotonic() + (timeout if timeout and timeout > 0 else 0)
+        ready = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._pending and self._pending[0][0] <= now:
+                    ready.append(heapq.heappop(self._pending))
+                if ready or now >= deadline:
+                    break
+                wait = deadline - now
+                if self._pending:
+                    wait = min(wait, self._pending[0][0] - now)
+                self._cond.wait(wait)
+        for _, _, cb, msg in ready:
+            if cb is not None:
+                cb(None, msg)
+        return len(ready)
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while len(self):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self.poll(0.01)
+        return len(self)
+
+    def list_topics(self, topic=None, timeout=-1):
+        return broker.metadata(topic)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def __bool__(self):
+        return True
+
+
+class FakeConsumer:
+    """
+    Consumer over the fake broker.
+
+    Subscribing assigns every partition of the topics (no rebalancing between
+    members); members of a group share committed offsets.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = dict(config)
+        self.group = self.config.get("group.id", "")
+        self.auto_commit = str(self.config.get("enable.auto.commit", True)).lower() != "false"
+        self.reset = self.config.get("auto.offset.reset", "latest")
+        self._positions: Dict[Tuple[str, int], int] = {}
+        self._subscription: List[str] = []
+        self._assigned: List[Tuple[str, int]] = []
+        self._paused: Set[Tuple[str, int]] = set()
+        self._closed = False
+        self._cursor = 0
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("Consumer closed")
+
+    def _start_offset(self, topic, partition, requested=OFFSET_STORED):
+        log = broker._topic(topic)[partition]
+        if requested >= 0:
+            return requested
+        if requested == OFFSET_BEGINNING:
+            return 0
+        if requested == OFFSET_END:
+            return len(log)
+        committed = broker.committed.get((self.group, topic, partition))
+        if committed is not None:
+            return committed
+        return 0 if self.reset in ("earliest", "smallest", "beginning") else len(log)
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None, on_lost=None):
+        self._check_open()
+        # Eager rebalance: the whole previous assignment, positions included, is revoked
+        revoked = [TopicPartition(t, p) for t, p in self._assigned]
+        if revoked and on_revoke:
+            on_revoke(self, revoked)
+        self._subscription = list(topics)
+        with broker.cond:
+            for tp in self._assigned:
+                self._positions.pop(tp, None)
+            self._assigned = [
+                (t, p) for t in self._subscription for p in range(len(broker._topic(t)))
+            ]
+            for tp in self._assigned:
+                self._positions.setdefault(tp, self._start_offset(*tp))
+        if on_assign:
+            on_assign(self, [TopicPartition(t, p) for t, p in self._assigned])
+
+    def unsubscribe(self):
+        self._subscription = []
+        self._assigned = []
+
+    def assign(self, partitions):
+        self._check_open()
+        with broker.cond:
+            self._assigned = []
+            self._paused = set()
+            for tp in partitions:
+                key = (tp.topic, tp.partition)
+                self._assigned.append(key)
+                self._positions[key] = self._start_offset(tp.topic, tp.partition, tp.offset)
+
+    def incremental_assign(self, partitions):
+        with broker.cond:
+            for tp in partitions:
+                key = (tp.topic, tp.partition)
+                if key not in self._assigned:
+                    self._assigned.append(key)
+                self._positions[key] = self._start_offset(tp.topic, tp.partition, tp.offset)
+
+    def incremental_unassign(self, partitions):
+        drop = {(tp.topic, tp.partition) for tp in partitions}
+        self._assigned = [tp for tp in self._assigned if tp not in drop]
+
+    def unassign(self):
+        self._assigned = []
+        self._paused = set()
+
+    def pause(self, partitions):
+        self._paused.update((tp.topic, tp.partition) for tp in partitions)
+
+    def resume(self, partitions):
+        self._paused.difference_update((tp.topic, tp.partition) for tp in partitions)
+
+    def assignment(self):
+        return [TopicPartition(t, p, self._positions.get((t, p), OFFSET_INVALID))
+                for t, p in self._assigned]
+
+    def seek(self, partition):
+        with broker.cond:
+            self._positions[(partition.topic, partition.partition)] = self._start_offset(
+                partition.topic, partition.partition, partition.offset)
+
+    def position(self, partitions):
+        return [TopicPartition(tp.topic, tp.partition,
+                               self._positions.get((tp.topic, tp.partition), OFFSET_INVALID))
+                for tp in partitions]
+
+    def get_watermark_offsets(self, partition, timeout=None, cached=False):
+        with broker.cond:
+            log = broker._topic(partition.topic)[partition.partition]
+            return 0, len(log)
+
+    def offsets_for_times(self, partitions, timeout=None):
+        out = []
+        with broker.cond:
+            for tp in partitions:
+                log = broker._topic(tp.topic)[tp.partition]
+                offset = next((m.offset() for m in log if m._timestamp >= tp.offset), OFFSET_END)
+                out.append(TopicPartition(tp.topic, tp.partition, offset))
+        return out
+
+    def committed(self, partitions, timeout=None):
+        return [TopicPartition(tp.topic, tp.partition,
+                               broker.committed.get((self.group, tp.topic, tp.partition),
+                                                    OFFSET_INVALID))
+                for tp in partitions]
+
+    def commit(self, message=None, offsets=None, asynchronous=True):
+        self._check_open()
+        with broker.cond:
+            if message is not None:
+                broker.committed[(self.group, message.topic(), message.partition())] = \
+                    message.offset() + 1
+            elif offsets is not None:
+                for tp in offsets:
+                    broker.committed[(self.group, tp.topic, tp.partition)] = tp.offset
+            else:
+                for (t, p), pos in self._positions.items():
+                    broker.committed[(self.group, t, p)] = pos
+        return None if asynchronous else self.committed(
+            [TopicPartition(t, p) for t, p in self._assigned])
+
+    def store_offsets(self, message=None, offsets=None):
+        self.commit(message=message, offsets=offsets)
+
+    def _take(self, limit: int) -> List[FakeMessage]:
+        out: List[FakeMessage] = []
+        n = len(self._assigned)
+        for i in range(n):
+            if len(out) >= limit:
+                break
+            key = self._assigned[(self._cursor + i) % n]
+            if key in self._paused:
+                continue
+            log = broker._topic(key[0])[key[1]]
+            pos = self._positions.get(key, 0)
+            if pos < len(log):
+                batch = log[pos:pos + (limit - len(out))]
+                out.extend(batch)
+                self._positions[key] = pos + len(batch)
+                if self.auto_commit:
+                    broker.committed[(self.group, key[0], key[1])] = pos + len(batch)
+        self._cursor += 1
+        return out
+
+    def consume(self, num_messages: int = 1, timeout: float = -1) -> List[FakeMessage]:
+        self._check_open()
+        deadline = time.monotonic() + (timeout if timeout is not None and timeout >= 0 else 3600)
+        with broker.cond:
+            while True:
+                out = self._take(num_messages)
+                remaining = deadline - time.monotonic()
+                if out or remaining <= 0 or self._closed:
+                    return out
+                broker.cond.wait(min(remaining, 0.1))
+
+    def poll(self, timeout: float = -1) -> Optional[FakeMessage]:
+        msgs = self.consume(1, timeout)
+        return msgs[0] if msgs else None
+
+    def list_topics(self, topic=None, timeout=-1):
+        return broker.metadata(topic)
+
+    def close(self):
+        self._closed = True
+        with broker.cond:
+            broker.cond.notify_all()
+
+
+def install(partitions: int = 3, ack_latency: float = 0.0) -> FakeBroker:
+    """Replace the confluent_kafka client classes with the fakes."""
+    broker.default_partitions = partitions
+    broker.ack_latency = ack_latency
+    confluent_kafka.Producer = FakeProducer
+    confluent_kafka.Consumer = FakeConsumer
+    return broker
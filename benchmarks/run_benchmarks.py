@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the producer and consumer servers.
+
+Runs producer_server.app and consumer_server.app in-process against the fake
+broker in fake_kafka.py and reports throughput, latency percentiles and
+memory per scenario as JSON, so runs can be diffed across commits:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --baseline before.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "producers"), os.path.join(ROOT, "consumers")]
+
+import fake_kafka  # noqa: E402
+from common.headers import build_headers  # noqa: E402
+
+SCENARIOS = ("produce", "produce_batch", "chat_send", "consume", "ws_fanout")
+CHAT_TOPIC = "anonymous-anime-universe"
+CONSUME_TOPIC = "bench-consume"
+# Matches the message_id of a bench message in JSON text and MessagePack frames alike
+BENCH_SEQ = re.compile(r'bench_(\d+)')
+
+
+# ─── Measurement helpers ──────────────────────────────────────────────────────
+def rss_mb() -> float:
+    """Current resident set size in MiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p99/mean/max of latency samples (seconds), reported in ms."""
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))] * 1000
+
+    return {
+        "p50_ms": round(pct(0.50), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+async def run_load(send: Callable[[int], Awaitable[Any]], total: int,
+                   concurrency: int) -> Dict[str, Any]:
+    """Issue total requests from concurrency workers; send(i) returns a response."""
+    latencies: List[float] = []
+    errors = 0
+    indices = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in indices:
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+        "req_per_s": round(total / elapsed, 1) if elapsed else None,
+        "latency": percentiles(latencies),
+        "memory": {
+            "rss_mb": round(rss_mb(), 1),
+            "rss_delta_mb": round(rss_mb() - rss_before, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        },
+    }
+
+
+# ─── HTTP scenarios ───────────────────────────────────────────────────────────
+async def bench_produce(client, args):
+    body = {"topic": "bench-produce", "message": {"n": 0, "payload": "x" * args.payload_size}}
+
+    async def send(i):
+        body["message"]["n"] = i
+        return await client.post("/produce", json=body)
+
+    await run_load(send, args.warmup, args.concurrency)
+    return await run_load(send, args.requests, args.concurrency)
+
+
+async def bench_produce_batch(client, args):
+    batch = [
+        {"topic": "bench-batch", "key": f"k{j}", "message": {"n": j, "payload": "x" * args.payload_size}}
+        for j in range(args.batch_size)
+    ]
+
+    async def send(i):
+        return await client.post("/produce/batch", json=batch)
+
+    total = max(1, args.requests // args.batch_size)
+    await run_load(send, max(1, args.warmup // args.batch_size), args.concurrency)
+    result = await run_load(send, total, args.concurrency)
+    result["batch_size"] = args.batch_size
+    result["messages_per_s"] = round(result["req_per_s"] * args.batch_size, 1)
+    return result
+
+
+async def bench_chat_send(client, args):
+    async def send(i):
+        return await client.post("/chat/send", json={
+            "username": f"user-{i % 100}", "text": "x" * args.payload_size, "room": "bench-chat"
+        })
+
+    await run_load(send, args.warmup, args.concurrency)
+    return await run_load(send, args.requests, args.concurrency)
+
+
+async def bench_consume(client, args, broker, codec):
+    max_messages = 10
+    value = codec.encode({"payload": "x" * args.payload_size})
+    for _ in range((args.warmup + args.requests) * max_messages):
+        broker.append(CONSUME_TOPIC, value)
+    body = {"topic": CONSUME_TOPIC, "group_id": "bench-consume", "max_messages": max_messages,
+            "timeout": 0.05}
+
+    async def send(i):
+        return await client.post("/consume", json=body)
+
+    await run_load(send, args.warmup, args.concurrency)
+    result = await run_load(send, args.requests, args.concurrency)
+    result["max_messages"] = max_messages
+    return result
+
+
+# ─── WebSocket fan-out ────────────────────────────────────────────────────────
+class BenchClient:
+    """A WebSocket client speaking raw ASGI to the app, counting chat frames."""
+
+    def __init__(self, app, path: str, tracker: "FanoutTracker", subprotocols=()):
+        self.tracker = tracker
+        self.accepted = asyncio.Event()
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.inbox.put_nowait({"type": "websocket.connect"})
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws",
+            "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": [(b"host", b"bench")], "subprotocols": list(subprotocols),
+            "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        }
+        self.task = asyncio.create_task(app(scope, self.inbox.get, self.send))
+
+    async def send(self, message):
+        kind = message["type"]
+        if kind == "websocket.accept":
+            self.accepted.set()
+        elif kind == "websocket.send":
+            self.tracker.on_frame(message.get("text") or message.get("bytes"))
+        elif kind == "websocket.close":
+            self.accepted.set()
+
+    def disconnect(self):
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+
+class FanoutTracker:
+    """Times how long each tagged chat message takes to reach every client."""
+
+    def __init__(self):
+        self.expected = 0
+        self.counts: Dict[int, int] = {}
+        self.done: Dict[int, asyncio.Event] = {}
+        self.frames = 0
+        self.bytes = 0
+        self.last_frame = time.perf_counter()
+
+    def on_frame(self, data):
+        self.frames += 1
+        self.bytes += len(data or "")
+        self.last_frame = time.perf_counter()
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+        for match in BENCH_SEQ.finditer(data or ""):
+            seq = int(match.group(1))
+            count = self.counts[seq] = self.counts.get(seq, 0) + 1
+            if count >= self.expected and seq in self.done:
+                self.done[seq].set()
+
+    async def quiesce(self, idle: float = 0.2, limit: float = 600.0):
+        """Wait until no frames have arrived for idle seconds."""
+        deadline = time.perf_counter() + limit
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(idle / 2)
+            if time.perf_counter() - self.last_frame >= idle:
+                return
+
+
+async def bench_ws_fanout(app, args, broker, codec, clients: int):
+    tracker = FanoutTracker()
+    tracker.expected = clients
+    gc.collect()
+    rss_before = rss_mb()
+
+    started = time.perf_counter()
+    path = "/ws/chat?batch=1" if args.ws_batch else "/ws/chat"
+    subprotocols = [args.ws_protocol] if args.ws_protocol else []
+    conns = [BenchClient(app, path, tracker, subprotocols) for _ in range(clients)]
+    await asyncio.wait_for(asyncio.gather(*(c.accepted.wait() for c in conns)), args.ws_timeout)
+    await tracker.quiesce()
+    connect_s = time.perf_counter() - started
+    rss_connected = rss_mb()
+
+    latencies: List[float] = []
+    timeouts = 0
+    frames_before = tracker.frames
+    bytes_before = tracker.bytes
+    fanout_started = time.perf_counter()
+    # Messages are written in bursts of ws_burst; latency is until a burst fully arrived
+    for first in range(0, args.ws_messages, args.ws_burst):
+        burst = range(first, min(first + args.ws_burst, args.ws_messages))
+        records = []
+        for seq in burst:
+            tracker.done[seq] = asyncio.Event()
+            payload = {
+                "type": "chat_message", "username": "bench", "text": "x" * args.payload_size,
+                "room": CHAT_TOPIC, "message_id": f"bench_{seq}", "bench_seq": seq,
+                "timestamp": datetime.now().isoformat(),
+            }
+            # Headers as /chat/send writes them, so tracing samples bench traffic too
+            records.append((codec.encode(payload), build_headers("chat_message", codec.content_type)))
+        # Encode first so the burst really is written back to back
+        sent = time.perf_counter()
+        for value, headers in records:
+            broker.append(CHAT_TOPIC, value, key=b"bench", headers=headers)
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(tracker.done[seq].wait() for seq in burst)), args.ws_timeout)
+            latencies.append(time.perf_counter() - sent)
+        except asyncio.TimeoutError:
+            timeouts += 1
+    fanout_s = time.perf_counter() - fanout_started
+    delivered = sum(tracker.counts.values())
+
+    started = time.perf_counter()
+    for conn in conns:
+        conn.disconnect()
+    await asyncio.wait(
+        [c.task for c in conns], timeout=args.ws_timeout
+    )
+    disconnect_s = time.perf_counter() - started
+
+    return {
+        "clients": clients,
+        "messages": args.ws_messages,
+        "burst": args.ws_burst,
+        "batched": args.ws_batch,
+        "protocol": args.ws_protocol or "json",
+        "timeouts": timeouts,
+        "deliveries": delivered,
+        "frames_during_fanout": tracker.frames - frames_before,
+        "bytes_during_fanout": tracker.bytes - bytes_before,
+        "deliveries_per_s": round(delivered / fanout_s, 1) if fanout_s else None,
+        "latency": percentiles(latencies),
+        "connect_s": round(connect_s, 4),
+        "disconnect_s": round(disconnect_s, 4),
+        "memory": {
+            "rss_mb": round(rss_connected, 1),
+            "rss_per_client_kb": round((rss_connected - rss_before) * 1024 / clients, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        },
+    }
+
+
+# ─── Runner ───────────────────────────────────────────────────────────────────
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+            text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+
+    broker = fake_kafka.install(partitions=args.partitions, ack_latency=args.ack_latency_ms / 1000)
+    broker.create_topic(CHAT_TOPIC)
+    # Templates are resolved relative to the repository root, as in the containers
+    os.chdir(ROOT)
+    import producer_server
+    import consumer_server
+
+    results: Dict[str, Any] = {}
+    producer_app, consumer_app = producer_server.app, consumer_server.app
+    async with contextlib.AsyncExitStack() as stack:
+        await stack.enter_async_context(producer_app.router.lifespan_context(producer_app))
+        await stack.enter_async_context(consumer_app.router.lifespan_context(consumer_app))
+        producer_client = await stack.enter_async_context(httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=producer_app), base_url="http://producer"))
+        consumer_client = await stack.enter_async_context(httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=consumer_app), base_url="http://consumer"))
+        # Kafka clients warm up in the background; measure only once both servers are ready
+        for server in (producer_server, consumer_server):
+            if not await server.warmup.wait_ready(timeout=30):
+                raise RuntimeError(f"{server.__name__} not ready: {server.warmup.status()}")
+
+        for name in args.scenarios:
+            print(f"▶ {name}", file=sys.stderr)
+            if name == "produce":
+                results[name] = await bench_produce(producer_client, args)
+            elif name == "produce_batch":
+                results[name] = await bench_produce_batch(producer_client, args)
+            elif name == "chat_send":
+                results[name] = await bench_chat_send(producer_client, args)
+            elif name == "consume":
+                results[name] = await bench_consume(
+                    consumer_client, args, broker, consumer_server.value_codec)
+            elif name == "ws_fanout":
+                results[name] = {}
+                for clients in args.ws_clients:
+                    print(f"  {clients} clients", file=sys.stderr)
+                    results[name][str(clients)] = await bench_ws_fanout(
+                        consumer_app, args, broker, consumer_server.value_codec, clients)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "codec": os.getenv("MESSAGE_CODEC", "json"),
+            "config": {
+                "requests": args.requests,
+                "warmup": args.warmup,
+                "concurrency": args.concurrency,
+                "batch_size": args.batch_size,
+                "payload_size": args.payload_size,
+                "partitions": args.partitions,
+                "ack_latency_ms": args.ack_latency_ms,
+                "ws_clients": args.ws_clients,
+                "ws_messages": args.ws_messages,
+            },
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Human-readable throughput/latency deltas against a previous run."""
+    lines = [f"Compared with {baseline['meta'].get('revision')} "
+             f"({baseline['meta'].get('timestamp')}):"]
+
+    def flatten(results):
+        for name, result in results.items():
+            if name == "ws_fanout":
+                for clients, sub in result.items():
+                    yield f"ws_fanout[{clients}]", sub
+            else:
+                yield name, result
+
+    old = dict(flatten(baseline.get("results", {})))
+    for name, result in flatten(current["results"]):
+        before = old.get(name)
+        if not before:
+            continue
+        for key in ("req_per_s", "deliveries_per_s"):
+            if result.get(key) and before.get(key):
+                change = (result[key] - before[key]) / before[key] * 100
+                lines.append(f"  {name:<18} {key:<17} {before[key]:>10} → {result[key]:>10} ({change:+.1f}%)")
+        for key in ("p50_ms", "p99_ms"):
+            new_v, old_v = result["latency"].get(key), before.get("latency", {}).get(key)
+            if new_v is not None and old_v:
+                change = (new_v - old_v) / old_v * 100
+                lines.append(f"  {name:<18} {key:<17} {old_v:>10} → {new_v:>10} ({change:+.1f}%)")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per HTTP scenario")
+    parser.add_argument("--warmup", type=int, default=200, help="untimed requests before each scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent HTTP clients")
+    parser.add_argument("--batch-size", type=int, default=100, help="messages per /produce/batch request")
+    parser.add_argument("--payload-size", type=int, default=256, help="bytes of filler per message")
+    parser.add_argument("--partitions", type=int, default=6, help="partitions per fake topic")
+    parser.add_argument("--ack-latency-ms", type=float, default=1.0, help="fake broker ack latency")
+    parser.add_argument("--ws-clients", default="10,1000,10000",
+                        help="comma-separated WebSocket client counts for ws_fanout")
+    parser.add_argument("--ws-messages", type=int, default=20, help="chat messages per fan-out run")
+    parser.add_argument("--ws-burst", type=int, default=1,
+                        help="chat messages written back to back before waiting for delivery")
+    parser.add_argument("--ws-batch", action="store_true",
+                        help="connect WebSocket clients in chat_batch mode (?batch=1)")
+    parser.add_argument("--ws-protocol", choices=("chat.json", "chat.msgpack"),
+                        help="WebSocket subprotocol the fan-out clients ask for")
+    parser.add_argument("--ws-timeout", type=float, default=120.0,
+                        help="seconds to wait for connects and each fan-out")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.ws_clients = [int(n) for n in args.ws_clients.split(",") if n]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Keep per-request/per-connection server logging out of the measurements
+    logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
+    # Server print()s go to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"✅ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print("\n".join(compare(baseline, report)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
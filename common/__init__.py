@@ -0,0 +1,3 @@
+"""
+Shared helpers used by both the producer and consumer servers.
+"""
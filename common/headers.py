@@ -0,0 +1,97 @@
+"""
+Kafka record headers that describe a message without decoding its value.
+
+The producer server writes them on every record it builds. Consumers read
+the type header to skip records they do not want before touching the value
+bytes, and the content-type header to pick the codec. Records without a
+schema-version header (written before headers existed, or by other clients)
+fall back to inspecting the decoded payload.
+"""
+
+import os
+import time
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from common.codecs import Codec, codec_for_content_type
+
+TYPE = "type"
+CONTENT_TYPE = "content-type"
+SCHEMA_VERSION = "schema-version"
+PRODUCED_AT = "produced-at"  # producer wall clock, epoch milliseconds
+TRACE_ID = "trace-id"        # 16 hex digits; consumers sample traces by it
+
+CURRENT_SCHEMA_VERSION = 1
+
+Headers = List[Tuple[str, bytes]]
+
+
+class RecordMeta(NamedTuple):
+    """Parsed headers of a record written by the producer server."""
+    type: Optional[str]
+    content_type: Optional[str]
+    schema_version: int
+    produced_at_ms: Optional[int]
+    trace_id: Optional[str]
+
+
+def new_trace_id() -> str:
+    return os.urandom(8).hex()
+
+
+def build_headers(message_type: Optional[str], content_type: str,
+                  produced_at: Optional[float] = None,
+                  trace_id: Optional[str] = None) -> Headers:
+    """Headers for a new record; message_type is omitted when the message has none."""
+    if produced_at is None:
+        produced_at = time.time()
+    headers = [
+        (SCHEMA_VERSION, str(CURRENT_SCHEMA_VERSION).encode()),
+        (CONTENT_TYPE, content_type.encode()),
+        (PRODUCED_AT, str(int(produced_at * 1000)).encode()),
+        (TRACE_ID, (trace_id or new_trace_id()).encode()),
+    ]
+    if message_type:
+        headers.append((TYPE, message_type.encode()))
+    return headers
+
+
+def parse_headers(headers: Optional[list]) -> Optional[RecordMeta]:
+    """Read our headers from msg.headers(); None for records that do not carry them."""
+    if not headers:
+        return None
+    found = {}
+    for name, value in headers:
+        if value is not None and name in (TYPE, CONTENT_TYPE, SCHEMA_VERSION, PRODUCED_AT,
+                                          TRACE_ID):
+            found[name] = value
+    try:
+        version = int(found[SCHEMA_VERSION])
+        produced_at = int(found[PRODUCED_AT]) if PRODUCED_AT in found else None
+    except (KeyError, ValueError):
+        return None
+    message_type = found.get(TYPE)
+    content_type = found.get(CONTENT_TYPE)
+    trace_id = found.get(TRACE_ID)
+    return RecordMeta(
+        message_type.decode("utf-8", "replace") if message_type is not None else None,
+        content_type.decode("utf-8", "replace") if content_type is not None else None,
+        version,
+        produced_at,
+        trace_id.decode("ascii", "replace") if trace_id is not None else None,
+    )
+
+
+def record_codec(meta: Optional[RecordMeta], default: Codec) -> Codec:
+    """Codec named by the content-type header, else default."""
+    if meta is None or meta.content_type is None:
+        return default
+    return codec_for_content_type(meta.content_type) or default
+
+
+def payload_type(payload: Any) -> Optional[str]:
+    """The "type" field of a decoded message, for records without headers."""
+    if isinstance(payload, dict):
+        value = payload.get("type")
+        if isinstance(value, str):
+            return value
+    return None
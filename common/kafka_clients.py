@@ -0,0 +1,188 @@
+"""
+Kafka client configuration, lazy construction and startup warm-up shared by
+the producer and consumer servers.
+
+Nothing here touches the network at import time: clients are built on first
+use, and a server's lifespan only schedules a KafkaWarmup task. The warm-up
+builds the clients, waits for the first metadata fetch and primes group
+coordinators in the background, retrying until the brokers answer, while
+/ready reports 503. Containers can therefore start before Kafka does and be
+routed traffic as soon as their clients are usable.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Mapping, Optional, Tuple, TypeVar
+
+logger = logging.getLogger("uvicorn.error")
+
+# librdkafka settings taken from the environment, e.g.
+# KAFKA_CLIENT_SECURITY_PROTOCOL=SSL -> security.protocol=SSL
+CLIENT_CONFIG_PREFIX = "KAFKA_CLIENT_"
+# Pause between attempts of a warm-up step that failed (brokers not up yet)
+WARMUP_RETRY_INTERVAL = float(os.getenv('KAFKA_WARMUP_RETRY_INTERVAL', '1'))
+# Longest a single warm-up attempt waits on the brokers
+WARMUP_TIMEOUT = float(os.getenv('KAFKA_WARMUP_TIMEOUT', '5'))
+
+CONSUMER_DEFAULTS: Dict[str, Any] = {
+    'auto.offset.reset': 'earliest',
+    'enable.auto.commit': True,
+    'session.timeout.ms': 6000,
+    'heartbeat.interval.ms': 2000,
+}
+
+
+def load_config(environ: Mapping[str, str] = os.environ) -> Dict[str, Any]:
+    """Connection settings common to every client: bootstrap servers plus KAFKA_CLIENT_* overrides."""
+    config: Dict[str, Any] = {
+        'bootstrap.servers': environ.get('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092'),
+    }
+    for key, value in environ.items():
+        if key.startswith(CLIENT_CONFIG_PREFIX) and len(key) > len(CLIENT_CONFIG_PREFIX):
+            config[key[len(CLIENT_CONFIG_PREFIX):].lower().replace('_', '.')] = value
+    return config
+
+
+BASE_CONFIG = load_config()
+
+
+def consumer_config(group_id: str, **overrides) -> Dict[str, Any]:
+    return {**BASE_CONFIG, **CONSUMER_DEFAULTS, 'group.id': group_id, **overrides}
+
+
+def producer_config(client_id: str, **overrides) -> Dict[str, Any]:
+    return {**BASE_CONFIG, 'client.id': client_id, **overrides}
+
+
+T = TypeVar("T")
+
+
+class LazyClient(Generic[T]):
+    """A client built by factory on first get(), from whichever thread asks first."""
+
+    def __init__(self, factory: Callable[[], T]):
+        self.factory = factory
+        self._client: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.factory()
+                client = self._client
+        return client
+
+    def close(self):
+        """Close the client if it was ever built; the next get() builds a new one."""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+
+class KafkaWarmup:
+    """
+    Runs a server's Kafka start-up steps in order from a background task.
+
+    A step is an async callable (blocking work goes through
+    asyncio.to_thread). One that raises is retried after
+    WARMUP_RETRY_INTERVAL until it succeeds, so a server started before its
+    brokers stays unready instead of failing. ready flips once every step
+    has completed. After that, /ready also fails while any of checks
+    (callables returning a problem description or None) reports a problem.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.steps: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        # Seconds from start() until each completed step finished
+        self.completed: Dict[str, float] = {}
+        self.current: Optional[str] = None
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.checks: List[Callable[[], Optional[str]]] = []
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def step(self, name: str):
+        """Decorator registering an async function as the next warm-up step."""
+        def register(fn: Callable[[], Awaitable[Any]]):
+            self.steps.append((name, fn))
+            return fn
+        return register
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _run(self):
+        for name, fn in self.steps:
+            self.current = name
+            self.attempts = 0
+            while True:
+                self.attempts += 1
+                try:
+                    await fn()
+                    break
+                except Exception as e:
+                    # Log the first failure only; brokers that are still booting fail every retry
+                    if self.attempts == 1:
+                        logger.warning(f"Kafka warm-up step '{name}' failed ({self.name}), "
+                                       f"retrying every {WARMUP_RETRY_INTERVAL:g}s: {e}")
+                    self.last_error = f"{name}: {e}"
+                    await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+            self.completed[name] = round(time.monotonic() - self.started_at, 3)
+        self.current = None
+        self.last_error = None
+        self._ready.set()
+        logger.info(f"✅ Kafka clients ready ({self.name}) in {self.completed_in:.2f}s")
+
+    @property
+    def completed_in(self) -> Optional[float]:
+        return max(self.completed.values(), default=0.0) if self.ready else None
+
+    def status(self) -> Dict[str, Any]:
+        """Body of the /ready endpoint."""
+        failures = [problem for problem in (check() for check in self.checks) if problem]
+        return {
+            "ready": self.ready and not failures,
+            "failures": failures,
+            "ready_after_seconds": self.completed_in,
+            "completed": self.completed,
+            "pending": [name for name, _ in self.steps if name not in self.completed],
+            "current_step": self.current,
+            "attempts": self.attempts if self.current else None,
+            "last_error": self.last_error,
+        }
+
+
+async def wait_metadata(cache, timeout: float = WARMUP_TIMEOUT):
+    """Warm-up helper: wait for a MetadataCache's first refresh, raising if it is not in yet."""
+    if not await asyncio.to_thread(cache.wait_refreshed, timeout):
+        raise TimeoutError(cache.last_error or f"no metadata after {timeout:g}s")
@@ -0,0 +1,164 @@
+"""
+Background Kafka metadata cache shared by the producer and consumer servers.
+
+A refresher thread calls list_topics() every KAFKA_METADATA_TTL seconds and
+keeps the result in memory, so /health and /topics never touch the network
+on the request path. librdkafka error_cb/stats_cb events flip connectivity
+immediately and wake the refresher instead of waiting for the next tick.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from confluent_kafka import KafkaError
+
+logger = logging.getLogger("uvicorn.error")
+
+METADATA_TTL = float(os.getenv('KAFKA_METADATA_TTL', '10'))
+METADATA_TIMEOUT = float(os.getenv('KAFKA_METADATA_TIMEOUT', '5'))
+# Metadata older than this is reported as stale (unhealthy)
+METADATA_STALE_AFTER = float(os.getenv('KAFKA_METADATA_STALE_AFTER', str(3 * METADATA_TTL)))
+# Retry interval while the cluster is unreachable
+METADATA_RETRY_INTERVAL = float(os.getenv('KAFKA_METADATA_RETRY_INTERVAL', '2'))
+# librdkafka statistics interval; 0 disables stats_cb (and the stats metrics)
+STATISTICS_INTERVAL_MS = int(os.getenv('KAFKA_STATISTICS_INTERVAL_MS', '15000'))
+
+# Error codes that mean the client lost its brokers
+_CONNECTIVITY_ERRORS = {
+    KafkaError._ALL_BROKERS_DOWN,
+    KafkaError._TRANSPORT,
+    KafkaError._RESOLVE,
+}
+
+
+class MetadataCache:
+    """
+    Keeps cluster metadata fresh from a background thread.
+
+    Readers only look at attributes that the refresher replaces atomically,
+    so no lock is needed on the request path.
+    """
+
+    def __init__(self, name: str, serve_callbacks: bool = False):
+        self.name = name
+        # Consumers used only for metadata are never polled elsewhere, so the
+        # refresher must poll them for error_cb/stats_cb to fire
+        self.serve_callbacks = serve_callbacks
+        self.client = None
+        self.connected = False
+        self.topics: Dict[str, int] = {}
+        self.last_refresh: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # Called with each parsed stats report (e.g. to export metrics)
+        self.stats_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        # Set by the first successful refresh
+        self.refreshed = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def client_config(self) -> Dict[str, Any]:
+        """Callback settings to merge into the config of clients feeding this cache."""
+        config: Dict[str, Any] = {'error_cb': self.on_error}
+        if STATISTICS_INTERVAL_MS > 0:
+            config['stats_cb'] = self.on_stats
+            config['statistics.interval.ms'] = STATISTICS_INTERVAL_MS
+        return config
+
+    def start(self, client):
+        """Begin refreshing metadata from client (anything with list_topics)."""
+        self.client = client
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-metadata", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def wait_refreshed(self, timeout: Optional[float] = None) -> bool:
+        """Block until metadata has been fetched once; False on timeout."""
+        return self.refreshed.wait(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._refresh()
+            interval = METADATA_TTL if self.connected else METADATA_RETRY_INTERVAL
+            deadline = time.monotonic() + interval
+            while not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if self.serve_callbacks:
+                    self.client.poll(0)
+                if self._wake.wait(min(remaining, 0.5)):
+                    self._wake.clear()
+                    break
+
+    def _refresh(self):
+        try:
+            md = self.client.list_topics(timeout=METADATA_TIMEOUT)
+        except Exception as e:
+            # Log transitions only; a down cluster would otherwise log every retry
+            if self.connected or self.last_error is None:
+                logger.error(f"Kafka metadata refresh failed ({self.name}): {e}")
+            self.connected = False
+            self.last_error = str(e)
+            return
+        self.topics = {
+            name: len(meta.partitions)
+            for name, meta in md.topics.items()
+        }
+        self.last_refresh = time.time()
+        self.last_error = None
+        self.connected = True
+        self.refreshed.set()
+
+    def on_error(self, err: KafkaError):
+        """librdkafka error_cb: mark the cluster unreachable on connectivity errors."""
+        if err.code() in _CONNECTIVITY_ERRORS:
+            if self.connected:
+                logger.error(f"Kafka connectivity lost ({self.name}): {err}")
+            self.connected = False
+            self.last_error = str(err)
+            self._wake.set()
+
+    def on_stats(self, stats_json: str):
+        """librdkafka stats_cb: brokers reported UP restore connectivity early."""
+        try:
+            stats = json.loads(stats_json)
+        except ValueError:
+            return
+        brokers = stats.get('brokers', {})
+        up = any(b.get('state') == 'UP' for b in brokers.values() if b.get('nodeid', -1) >= 0)
+        if up and not self.connected:
+            self._wake.set()
+        elif not up and brokers:
+            self.connected = False
+        for listener in self.stats_listeners:
+            listener(stats)
+
+    @property
+    def age(self) -> Optional[float]:
+        """Seconds since the last successful refresh."""
+        if self.last_refresh is None:
+            return None
+        return time.time() - self.last_refresh
+
+    @property
+    def healthy(self) -> bool:
+        age = self.age
+        return self.connected and age is not None and age <= METADATA_STALE_AFTER
+
+    def last_refresh_iso(self) -> Optional[str]:
+        if self.last_refresh is None:
+            return None
+        return datetime.fromtimestamp(self.last_refresh).isoformat()
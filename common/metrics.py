@@ -0,0 +1,325 @@
+"""
+Minimal Prometheus instrumentation shared by the producer and consumer servers.
+
+Metrics are plain Python objects with preallocated children and fixed
+histogram buckets, so recording a sample is a dict lookup and a list
+increment. Samples must be recorded from the event loop thread (or under
+the GIL from a single thread per metric); nothing on the hot path logs.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request and fan-out latencies (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...],
+                   extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named family of children keyed by label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values):
+        """Return (creating once) the child for these label values."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for key, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class CallbackGauge(Metric):
+    """Gauge whose samples are computed at scrape time: fn() -> value or [(labels, value)]."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], Any],
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def samples(self):
+        result = self.fn()
+        if not self.labelnames:
+            result = [((), result)]
+        for key, value in result:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class CallbackCounter(CallbackGauge):
+    """Counter read at scrape time from a value maintained elsewhere."""
+
+    type = "counter"
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation within its bucket (as histogram_quantile)."""
+        if not self.count:
+            return float("nan")
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if i == len(self.bounds):
+                    # +Inf bucket: the highest finite bound is the best estimate
+                    return self.bounds[-1] if self.bounds else float("nan")
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+            if i < len(self.bounds):
+                lower = self.bounds[i]
+        return lower
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {child.sum}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class MetricsRegistry:
+    """Collects one server's metrics and renders them in Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def callback_gauge(self, *args, **kwargs) -> CallbackGauge:
+        return self.register(CallbackGauge(*args, **kwargs))
+
+    def callback_counter(self, *args, **kwargs) -> CallbackCounter:
+        return self.register(CallbackCounter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording per-endpoint HTTP latency.
+
+    Routes are labelled by their path template (e.g. /messages/{topic}) so
+    label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app, histogram: Histogram):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            self.histogram.labels(scope["method"], path, status[0]).observe(
+                time.perf_counter() - start
+            )
+
+
+class KafkaStatsCollector:
+    """
+    Turns librdkafka statistics (statistics.interval.ms) into gauges.
+
+    Each stats_cb call replaces the samples for that client, so the scrape
+    always shows the latest report per client instance.
+    """
+
+    def __init__(self, registry: MetricsRegistry, prefix: str = "kafka_client"):
+        self.prefix = prefix
+        self._samples: Dict[str, Dict[str, List[Tuple[Tuple[str, ...], float]]]] = {}
+        self._families = {
+            "queue_messages": ("Messages in the client's producer queue (msg_cnt)", ("client",)),
+            "queue_bytes": ("Bytes in the client's producer queue (msg_size)", ("client",)),
+            "tx_messages_total": ("Messages transmitted to brokers (txmsgs)", ("client",)),
+            "rx_messages_total": ("Messages consumed from brokers (rxmsgs)", ("client",)),
+            "broker_rtt_avg_seconds": ("Broker request round-trip time, average", ("client", "broker")),
+            "broker_rtt_p99_seconds": ("Broker request round-trip time, p99", ("client", "broker")),
+            "broker_outbuf_requests": ("Requests waiting to be sent to the broker", ("client", "broker")),
+            "topic_batch_size_avg_bytes": ("Average produced batch size", ("client", "topic")),
+            "topic_batch_messages_avg": ("Average messages per produced batch", ("client", "topic")),
+            "consumer_lag": ("Consumer lag per partition", ("client", "topic", "partition")),
+            "fetch_queue_messages": ("Pre-fetched messages waiting per partition", ("client", "topic", "partition")),
+        }
+        for family, (doc, labelnames) in self._families.items():
+            registry.callback_gauge(
+                f"{prefix}_{family}", doc, self._family_samples(family), labelnames
+            )
+
+    def _family_samples(self, family: str):
+        def collect():
+            for per_client in list(self._samples.values()):
+                yield from per_client.get(family, ())
+        return collect
+
+    def on_stats(self, stats: Dict[str, Any]):
+        """Record one parsed librdkafka statistics report."""
+        # "name" is unique per client instance ("client.id#producer-1")
+        client = stats.get("name") or stats.get("client_id", "unknown")
+        out: Dict[str, List[Tuple[Tuple[str, ...], float]]] = {f: [] for f in self._families}
+        c = (client,)
+        out["queue_messages"].append((c, stats.get("msg_cnt", 0)))
+        out["queue_bytes"].append((c, stats.get("msg_size", 0)))
+        out["tx_messages_total"].append((c, stats.get("txmsgs", 0)))
+        out["rx_messages_total"].append((c, stats.get("rxmsgs", 0)))
+
+        for broker in stats.get("brokers", {}).values():
+            if broker.get("nodeid", -1) < 0:
+                continue
+            key = (client, broker.get("name", ""))
+            rtt = broker.get("rtt") or {}
+            out["broker_rtt_avg_seconds"].append((key, rtt.get("avg", 0) / 1e6))
+            out["broker_rtt_p99_seconds"].append((key, rtt.get("p99", 0) / 1e6))
+            out["broker_outbuf_requests"].append((key, broker.get("outbuf_cnt", 0)))
+
+        for topic, tstats in stats.get("topics", {}).items():
+            batchsize = tstats.get("batchsize") or {}
+            batchcnt = tstats.get("batchcnt") or {}
+            if batchcnt.get("cnt"):
+                out["topic_batch_size_avg_bytes"].append(((client, topic), batchsize.get("avg", 0)))
+                out["topic_batch_messages_avg"].append(((client, topic), batchcnt.get("avg", 0)))
+            for partition, pstats in tstats.get("partitions", {}).items():
+                if partition == "-1":
+                    continue
+                key = (client, topic, partition)
+                lag = pstats.get("consumer_lag", -1)
+                if lag >= 0:
+                    out["consumer_lag"].append((key, lag))
+                if pstats.get("fetchq_cnt"):
+                    out["fetch_queue_messages"].append((key, pstats["fetchq_cnt"]))
+
+        self._samples[client] = out
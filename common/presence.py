@@ -0,0 +1,103 @@
+"""
+Per-room WebSocket client counts shared by worker processes on one host.
+
+Each worker claims a numbered slot by taking an exclusive flock on a slot
+file; the lock is released by the kernel if the worker dies, so slots are
+reused across restarts. A worker publishes its own room counts by atomically
+replacing a small JSON snapshot (on tmpfs by default) and reads the other
+workers' snapshots every PRESENCE_INTERVAL seconds. Snapshots that have not
+been rewritten for a few intervals belong to dead workers and are ignored.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+PRESENCE_INTERVAL = float(os.getenv('WS_PRESENCE_INTERVAL', '0.5'))
+# Snapshots older than this many intervals are from workers that stopped
+PRESENCE_STALE_INTERVALS = 6
+_DEFAULT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+PRESENCE_DIR = os.getenv('WS_PRESENCE_DIR', os.path.join(_DEFAULT_DIR, "kafka-ws-presence"))
+MAX_SLOTS = 1024
+
+
+class PresenceBoard:
+    """Local room counts published to, and summed with, the other workers."""
+
+    def __init__(self, directory: str = PRESENCE_DIR):
+        self.directory = directory
+        self.slot: Optional[int] = None
+        self.remote: Dict[str, int] = {}
+        self._lock_file = None
+        self._published: Optional[Dict[str, int]] = None
+        self._published_at = 0.0
+
+    def claim_slot(self) -> int:
+        """Take the lowest free worker slot; it stays ours until close() or exit."""
+        os.makedirs(self.directory, exist_ok=True)
+        for slot in range(MAX_SLOTS):
+            f = open(os.path.join(self.directory, f"slot-{slot}.lock"), "w")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            self._lock_file = f
+            self.slot = slot
+            return slot
+        raise RuntimeError(f"No free presence slot in {self.directory}")
+
+    def _snapshot_path(self, slot: int) -> str:
+        return os.path.join(self.directory, f"slot-{slot}.json")
+
+    def publish(self, counts: Dict[str, int]):
+        """Write our counts if they changed, and at least once per interval as a heartbeat."""
+        now = time.time()
+        if counts == self._published and now - self._published_at < PRESENCE_INTERVAL:
+            return
+        path = self._snapshot_path(self.slot)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"pid": os.getpid(), "ts": now, "rooms": counts}, f)
+        os.replace(tmp, path)
+        self._published = dict(counts)
+        self._published_at = now
+
+    def refresh(self) -> Dict[str, int]:
+        """Re-read the other workers' snapshots; returns their summed room counts."""
+        totals: Dict[str, int] = {}
+        stale_before = time.time() - PRESENCE_STALE_INTERVALS * PRESENCE_INTERVAL
+        for name in os.listdir(self.directory):
+            if not (name.startswith("slot-") and name.endswith(".json")):
+                continue
+            if name == f"slot-{self.slot}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                # Removed or being replaced; the next refresh will see it
+                continue
+            if snapshot.get("ts", 0) < stale_before:
+                continue
+            for room, n in snapshot.get("rooms", {}).items():
+                totals[room] = totals.get(room, 0) + n
+        self.remote = totals
+        return totals
+
+    def close(self):
+        if self.slot is None:
+            return
+        try:
+            os.unlink(self._snapshot_path(self.slot))
+        except OSError:
+            pass
+        self._lock_file.close()
+        self._lock_file = None
+        self.slot = None
@@ -7,20 +7,36 @@ and a WebSocket endpoint for real-time chat.
 
 import os
 import time
-import json
 import logging
 import asyncio
 import contextlib
+import re
+import socket
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List, Optional, Set
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Header, HTTPException, WebSocket, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from confluent_kafka import Consumer, KafkaError
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
+
+from common.codecs import CODECS, default_codec, dumps_text, get_codec
+from common.headers import parse_headers, payload_type, record_codec
+from common.kafka_clients import (
+    WARMUP_TIMEOUT, KafkaWarmup, LazyClient, consumer_config, wait_metadata
+)
+from common.metadata import METADATA_TIMEOUT, MetadataCache
+from common.presence import PRESENCE_INTERVAL, PresenceBoard
+from common.metrics import (
+    CONTENT_TYPE_LATEST, Histogram, KafkaStatsCollector, MetricsRegistry,
+    RequestMetricsMiddleware
+)
 
 # ─── Logging ───────────────────────────────────────────────────────────────────
 logger = logging.getLogger("uvicorn.error")
@@ -30,19 +46,23 @@ class ConsumeRequest(BaseModel):
     topic: str = "test-topic"
     group_id: str = "python-consumer-api-group"
     max_messages: int = 10
-    timeout: float = 5.0
+    timeout: float = 5.0            # overall deadline (seconds), capped at CONSUMER_MAX_TIMEOUT
+    max_bytes: Optional[int] = None # return early once this many value bytes are read
+    codec: Optional[str] = None     # overrides MESSAGE_CODEC; "raw" skips decoding
+    message_type: Optional[str] = None  # only return messages of this type
 
 class ChatMessageRequest(BaseModel):
     topic: str = "anonymous-anime-universe"
-    group_id: str = "chat-consumer-group"
-    last_message_id: Optional[str] = None
+    group_id: str = "chat-consumer-group"   # only used for rooms without history
+    last_message_id: Optional[str] = None   # return messages after this one
+    limit: int = 50
 
 class MessageInfo(BaseModel):
     topic: str
     partition: int
     offset: int
     key: Optional[str]
-    value: Dict[str, Any]
+    value: Any
     timestamp: str
 
 class ConsumeResponse(BaseModel):
@@ -56,39 +76,961 @@ class HealthResponse(BaseModel):
     status: str
     timestamp: str
     kafka_connected: bool
+    metadata_age_seconds: Optional[float] = None
+    last_metadata_refresh: Optional[str] = None
+    ws_consumer_error: Optional[str] = None
 
 class TopicInfo(BaseModel):
     topic: str
     partitions: int
     group_id: str
 
+# ─── Metrics ──────────────────────────────────────────────────────────────────
+metrics = MetricsRegistry()
+REQUEST_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by endpoint",
+    ("method", "route", "status")
+)
+WS_FANOUT_DURATION = metrics.histogram(
+    "ws_broadcast_duration_seconds", "Time to fan one frame out to all WebSocket clients"
+)
+WS_MESSAGES_BROADCAST = metrics.counter(
+    "ws_broadcast_messages_total", "Frames broadcast to WebSocket clients"
+)
+WS_SEND_FAILURES = metrics.counter(
+    "ws_send_failures_total", "WebSocket sends that failed"
+)
+WS_FRAMES_DROPPED = metrics.counter(
+    "ws_frames_dropped_total", "Outbound frames dropped from full client queues", ("reason",)
+)
+WS_CLIENTS_EVICTED = metrics.counter(
+    "ws_clients_evicted_total", "WebSocket clients disconnected for falling behind", ("reason",)
+)
+WS_OFFSET_COMMITS = metrics.counter(
+    "ws_offset_commits_total", "Offset commits of the WebSocket consumer", ("mode",)
+)
+WS_SENT_BYTES = metrics.counter(
+    "ws_sent_bytes_total", "WebSocket payload bytes sent, before compression", ("protocol",)
+)
+# Delivery stages run from tens of microseconds (decode) to seconds (a slow broker)
+TRACE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WS_DELIVERY_STAGE = metrics.histogram(
+    "ws_delivery_stage_seconds", "Sampled chat message latency per delivery stage", ("stage",),
+    buckets=TRACE_BUCKETS
+)
+WS_BATCH_SIZE = metrics.histogram(
+    "ws_batch_messages", "Chat messages per chat_batch frame",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+STREAM_OVERFLOWS = metrics.counter(
+    "stream_overflows_total", "Topic streams closed because the client fell behind"
+)
+metrics.callback_gauge("streams_active", "Open /stream connections",
+                       lambda: sum(len(s) for s in list(stream_hub.streams.values())))
+metrics.callback_gauge("ws_send_queue_frames", "Frames waiting in client send queues",
+                       lambda: sum(len(c.queue) for c in list(manager.active_connections.values())))
+metrics.callback_gauge("ws_active_connections", "Connected WebSocket clients",
+                       lambda: len(manager.active_connections))
+metrics.callback_gauge("ws_rooms", "Chat rooms with at least one WebSocket client",
+                       lambda: len(manager.rooms))
+metrics.callback_gauge("consumer_pool_consumers", "Pooled HTTP consumers by state",
+                       lambda: [(("idle",), consumer_pool.idle_count),
+                                (("leased",), consumer_pool.leased_count)],
+                       ("state",))
+metrics.callback_counter("consumer_pool_leases_total", "Consumer leases by outcome",
+                         lambda: [(("reused",), consumer_pool.reused),
+                                  (("created",), consumer_pool.created),
+                                  (("rejected",), consumer_pool.rejected)],
+                         ("outcome",))
+metrics.callback_counter("consumer_pool_evictions_total", "Idle pooled consumers closed",
+                         lambda: consumer_pool.evicted)
+kafka_stats = KafkaStatsCollector(metrics)
+
 # ─── Kafka setup ────────────────────────────────────────────────────────────────
-def create_consumer(group_id: str) -> Consumer:
-    return Consumer({
-        'bootstrap.servers': os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092'),
-        'group.id': group_id,
-        'auto.offset.reset': 'earliest',
-        'enable.auto.commit': True,
-        'session.timeout.ms': 6000,
-        'heartbeat.interval.ms': 2000,
-    })
-
-# A dedicated consumer just for health checks
-health_consumer = create_consumer("health-check-group")
+# Codec for message values read from Kafka (MESSAGE_CODEC: json, orjson, msgpack, raw)
+value_codec = default_codec()
+
+def create_consumer(group_id: str, **extra_config) -> Consumer:
+    return Consumer(consumer_config(group_id, **extra_config))
+
+# Cluster metadata refreshed in the background for /health and /topics
+metadata_cache = MetadataCache("consumer", serve_callbacks=True)
+metadata_cache.stats_listeners.append(kafka_stats.on_stats)
+
+# A dedicated consumer just for health checks, built by the startup warm-up
+health_consumer = LazyClient(
+    lambda: create_consumer("health-check-group", **metadata_cache.client_config()))
 
 def check_kafka_connection() -> bool:
+    return metadata_cache.healthy
+
+# ─── Consumer pool ────────────────────────────────────────────────────────────
+# Consumers allowed per group at once; more members would rebalance each other
+POOL_MAX_PER_GROUP = int(os.getenv('CONSUMER_POOL_MAX_PER_GROUP', '1'))
+# Idle consumers are closed (leaving their group) after this many seconds
+POOL_IDLE_SECONDS = float(os.getenv('CONSUMER_POOL_IDLE_SECONDS', '60'))
+# How long a request waits for a busy group's consumer before a 429
+POOL_LEASE_TIMEOUT = float(os.getenv('CONSUMER_POOL_LEASE_TIMEOUT', '10'))
+RETRY_AFTER_SECONDS = int(os.getenv('CONSUMER_RETRY_AFTER_SECONDS', '1'))
+# Threads running blocking consume()/close() calls for HTTP reads
+POOL_THREADS = int(os.getenv('CONSUMER_POOL_THREADS', '8'))
+# Batched reads: byte budget cap, and how long to wait for more once messages arrived
+CONSUME_MAX_BYTES = int(os.getenv('CONSUMER_MAX_BYTES', str(8 * 1024 * 1024)))
+CONSUME_LINGER = float(os.getenv('CONSUMER_LINGER_MS', '100')) / 1000.0
+CONSUME_BATCH_SIZE = int(os.getenv('CONSUMER_BATCH_SIZE', '100'))
+# Upper bound for the per-request timeout of /consume and /messages/{topic}
+CONSUME_MAX_TIMEOUT = float(os.getenv('CONSUMER_MAX_TIMEOUT', '30'))
+
+class ConsumerPoolExhausted(Exception):
+    """Raised when no consumer for a group frees up within the lease timeout."""
+
+class PooledConsumer:
+    def __init__(self, key: Tuple[str, Tuple[str, ...]], consumer: Consumer):
+        self.key = key
+        self.consumer = consumer
+        self.last_used = time.monotonic()
+
+class ConsumerPool:
+    """
+    Keeps subscribed consumers warm between HTTP requests.
+
+    Consumers are keyed by (group_id, topics) and leased to one request at a
+    time, so their group membership and partition assignment survive across
+    calls instead of paying a join and rebalance per request. At most
+    max_per_group consumers exist per group (or limits[group_id]); other
+    requests wait for one to be returned. Blocking client calls run on a
+    bounded thread pool so they never stall the event loop; bookkeeping
+    happens on the loop thread only.
+
+    An empty topic list leases an unsubscribed consumer for manual assign().
+    Such consumers never join their group and never commit.
+    """
+
+    def __init__(self, max_per_group: int, idle_timeout: float, lease_timeout: float,
+                 threads: int):
+        self.max_per_group = max_per_group
+        # Per-group overrides of max_per_group
+        self.limits: Dict[str, int] = {}
+        self.idle_timeout = idle_timeout
+        self.lease_timeout = lease_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="consume")
+        self._running: Set[asyncio.Future] = set()
+        self._idle: Dict[Tuple[str, Tuple[str, ...]], List[PooledConsumer]] = defaultdict(list)
+        self._group_sizes: Dict[str, int] = defaultdict(int)
+        self._waiters: Dict[str, deque] = defaultdict(deque)
+        self._evictor: Optional[asyncio.Task] = None
+        self._closed = False
+        self.reused = 0
+        self.created = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    @property
+    def idle_count(self) -> int:
+        return sum(len(entries) for entries in self._idle.values())
+
+    @property
+    def leased_count(self) -> int:
+        return sum(self._group_sizes.values()) - self.idle_count
+
+    async def run(self, group_id: str, topics: List[str], fn: Callable[..., Any], *args) -> Any:
+        """
+        Lease a consumer subscribed to topics and run fn(consumer, *args) on
+        the pool's threads. The lease ends when fn returns, even if the
+        request is cancelled first, so a consumer is never used by two threads.
+        """
+        entry = await self._acquire(group_id, tuple(sorted(set(topics))))
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, fn, entry.consumer, *args)
+        except BaseException:
+            self._release(entry)
+            raise
+        self._running.add(future)
+
+        def done(_):
+            self._running.discard(future)
+            self._release(entry)
+
+        future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    async def _acquire(self, group_id: str, topics: Tuple[str, ...]) -> PooledConsumer:
+        key = (group_id, topics)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lease_timeout
+        while True:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            limit = self.limits.get(group_id, self.max_per_group)
+            if self._group_sizes[group_id] < limit:
+                return self._create(key)
+            # Retire an idle member subscribed to other topics to make room
+            victim = self._pop_idle_in_group(group_id)
+            if victim is not None:
+                self._discard(victim)
+                continue
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.rejected += 1
+                raise ConsumerPoolExhausted(
+                    f"All {limit} consumer(s) for group '{group_id}' are busy"
+                )
+            # Released consumers are handed to waiters in arrival order
+            waiter = loop.create_future()
+            self._waiters[group_id].append((key, waiter))
+            try:
+                await asyncio.wait((waiter,), timeout=remaining)
+            except BaseException:
+                if not waiter.cancel() and waiter.result() is not None:
+                    self._release(waiter.result())
+                raise
+            if waiter.cancel():
+                continue
+            entry = waiter.result()
+            if entry is not None:
+                self.reused += 1
+                return entry
+
+    def _create(self, key: Tuple[str, Tuple[str, ...]]) -> PooledConsumer:
+        group_id, topics = key
+        self._group_sizes[group_id] += 1
+        try:
+            if topics:
+                consumer = create_consumer(group_id)
+                consumer.subscribe(list(topics))
+            else:
+                consumer = create_consumer(group_id, **{
+                    'enable.auto.commit': False,
+                    'enable.auto.offset.store': False,
+                })
+        except BaseException:
+            self._group_sizes[group_id] -= 1
+            raise
+        self.created += 1
+        return PooledConsumer(key, consumer)
+
+    def _pop_idle_in_group(self, group_id: str) -> Optional[PooledConsumer]:
+        for (group, _), entries in self._idle.items():
+            if group == group_id and entries:
+                return entries.pop(0)
+        return None
+
+    def _release(self, entry: PooledConsumer):
+        entry.last_used = time.monotonic()
+        if self._closed:
+            self._discard(entry)
+            return
+        if self._hand_off(entry):
+            return
+        self._idle[entry.key].append(entry)
+        self._wake(entry.key[0])
+
+    def _discard(self, entry: PooledConsumer):
+        """Close a consumer that is no longer pooled (close() blocks on the group leave)."""
+        self._forget(entry)
+        asyncio.get_running_loop().run_in_executor(self.executor, entry.consumer.close)
+        self._wake(entry.key[0])
+
+    def _forget(self, entry: PooledConsumer):
+        group_id = entry.key[0]
+        self._group_sizes[group_id] -= 1
+        if not self._group_sizes[group_id]:
+            del self._group_sizes[group_id]
+
+    def _hand_off(self, entry: PooledConsumer) -> bool:
+        """Give a released consumer to the oldest waiter for the same topics."""
+        waiters = self._waiters.get(entry.key[0])
+        if not waiters:
+            return False
+        for i, (key, waiter) in enumerate(waiters):
+            if key == entry.key and not waiter.done():
+                del waiters[i]
+                waiter.set_result(entry)
+                return True
+        return False
+
+    def _wake(self, group_id: str):
+        """Let the oldest waiter of a group retry (room freed or an idle consumer to retire)."""
+        waiters = self._waiters.get(group_id)
+        while waiters:
+            _, waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+        if waiters is not None and not waiters:
+            del self._waiters[group_id]
+
+    def evict_idle(self):
+        """Close consumers that have not been leased for idle_timeout seconds."""
+        cutoff = time.monotonic() - self.idle_timeout
+        for key in list(self._idle):
+            entries = self._idle[key]
+            expired = [e for e in entries if e.last_used <= cutoff]
+            if expired:
+                self._idle[key] = [e for e in entries if e.last_used > cutoff]
+                for entry in expired:
+                    self.evicted += 1
+                    self._discard(entry)
+            if not self._idle[key]:
+                del self._idle[key]
+
+    async def _run_evictor(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 2))
+            self.evict_idle()
+
+    def start(self):
+        self._closed = False
+        self._evictor = asyncio.create_task(self._run_evictor())
+
+    async def close(self):
+        """Stop eviction, wait for running reads and close every consumer."""
+        if self._evictor:
+            self._evictor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._evictor
+            self._evictor = None
+        # Reads are bounded by their request deadlines
+        if self._running:
+            await asyncio.wait(list(self._running))
+        self._closed = True
+        entries = [e for group in self._idle.values() for e in group]
+        self._idle.clear()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, e.consumer.close)
+                               for e in entries))
+        for entry in entries:
+            self._forget(entry)
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "idle_consumers": self.idle_count,
+            "leased_consumers": self.leased_count,
+            "groups": dict(self._group_sizes),
+            "waiting_requests": sum(
+                1 for waiters in self._waiters.values() for _, w in waiters if not w.done()
+            ),
+            "max_per_group": self.max_per_group,
+            "idle_timeout_seconds": self.idle_timeout,
+            "leases_reused": self.reused,
+            "leases_created": self.created,
+            "leases_rejected": self.rejected,
+            "evicted": self.evicted,
+        }
+
+consumer_pool = ConsumerPool(POOL_MAX_PER_GROUP, POOL_IDLE_SECONDS, POOL_LEASE_TIMEOUT,
+                             POOL_THREADS)
+
+def pool_exhausted_error(e: ConsumerPoolExhausted) -> HTTPException:
+    return HTTPException(429, str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+def read_timeout(timeout: float) -> float:
+    """Clamp a client-requested read timeout to the configured maximum."""
+    return min(max(timeout, 0.0), CONSUME_MAX_TIMEOUT)
+
+def read_batch(consumer: Consumer, max_messages: int, timeout: float, max_bytes: int,
+               codec=None, message_type: Optional[str] = None
+               ) -> Tuple[List[MessageInfo], Optional[KafkaError]]:
+    """
+    Read up to max_messages with consume() batches within one overall deadline.
+
+    Runs on a pool thread. Returns early once max_bytes of values were read
+    or, after the first messages arrived, when no more show up within
+    CONSUME_LINGER. Messages cannot be handed back once consumed, so under
+    a max_bytes budget the first batch is a single message and later ones
+    hold only as many as fit the rest of the budget at the average size.
+    Values are decoded in one pass at the end; undecodable values are
+    skipped. With message_type, records whose type header differs
+    are skipped without decoding (headerless records are checked after
+    decoding). codec=None decodes with the codec named by each record's
+    content-type header. A Kafka error stops the read and is returned
+    alongside whatever was read before it.
+    """
+    deadline = time.monotonic() + max(timeout, 0.0)
+    raw = []
+    size = 0
+    error: Optional[KafkaError] = None
+    while len(raw) < max_messages and size < max_bytes:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        wait = min(remaining, CONSUME_LINGER) if raw else remaining
+        count = min(max_messages - len(raw), CONSUME_BATCH_SIZE)
+        if size:
+            count = min(count, max(1, (max_bytes - size) * len(raw) // size))
+        elif max_bytes < CONSUME_MAX_BYTES:
+            # Sizes are unknown until the first message; probe with one
+            count = 1
+        batch = consumer.consume(count, wait)
+        if not batch:
+            if raw:
+                break
+            continue
+        for msg in batch:
+            err = msg.error()
+            if err:
+                if err.code() != KafkaError._PARTITION_EOF:
+                    error = err
+                    break
+                continue
+            raw.append(msg)
+            size += len(msg.value() or b"")
+        if error:
+            break
+
+    received = datetime.utcnow().isoformat()
+    out: List[MessageInfo] = []
+    for msg in raw:
+        meta = parse_headers(msg.headers())
+        if message_type is not None and meta is not None and meta.type != message_type:
+            continue
+        try:
+            data = (codec or record_codec(meta, value_codec)).decode(msg.value())
+        except Exception:
+            continue
+        if message_type is not None and meta is None and payload_type(data) != message_type:
+            continue
+        key = msg.key()
+        out.append(MessageInfo(
+            topic=msg.topic(),
+            partition=msg.partition(),
+            offset=msg.offset(),
+            key=key.decode() if key else None,
+            value=data,
+            timestamp=received
+        ))
+    return out, error
+
+# ─── Replay reads ─────────────────────────────────────────────────────────────
+# /messages/{topic} leases assign-only consumers from the pool under this group
+REPLAY_GROUP = "replay-reader"
+REPLAY_READERS = int(os.getenv('CONSUMER_REPLAY_READERS', '4'))
+REPLAY_MAX_LIMIT = int(os.getenv('CONSUMER_REPLAY_MAX_LIMIT', '1000'))
+consumer_pool.limits[REPLAY_GROUP] = REPLAY_READERS
+
+class ReplayPosition(BaseModel):
+    """Where a replay page starts; the first field that is set wins."""
+    cursor: Optional[Dict[int, int]] = None   # partition -> next offset
+    timestamp_ms: Optional[int] = None
+    offset: Optional[int] = None              # negative: that many before the end
+
+def parse_cursor(cursor: str) -> Dict[int, int]:
+    """Parse "partition:offset,partition:offset" (as returned in next_cursor)."""
     try:
-        health_consumer.list_topics(timeout=5)
+        return dict(
+            (int(p), int(o)) for p, o in (part.split(":") for part in cursor.split(",") if part)
+        )
+    except ValueError:
+        raise HTTPException(400, "cursor must be partition:offset[,partition:offset...]")
+
+def format_cursor(offsets: Dict[int, int]) -> str:
+    return ",".join(f"{p}:{o}" for p, o in sorted(offsets.items()))
+
+def read_range(consumer: Consumer, topic: str, partitions: Optional[List[int]],
+               partition_count: Optional[int], position: ReplayPosition,
+               limit: int, timeout: float, codec) -> Dict[str, Any]:
+    """
+    Read one page of topic with assign()/seek-style start offsets; no group, no commits.
+
+    Runs on a pool thread. Every partition is assigned to the one consumer,
+    so librdkafka fetches them in parallel; a partition is paused once it
+    has limit records or reaches the high watermark seen at the start. The
+    page is the first limit records by timestamp (the last limit when no
+    start is given), and next_cursor points just past what was returned for
+    each partition. partitions=None reads them all; partition_count comes
+    from the metadata cache. Raises LookupError for an unknown topic and
+    ValueError for a partition it does not have.
+    """
+    deadline = time.monotonic() + max(timeout, 0.0)
+    if partition_count is None:
+        # Not in the metadata cache yet; ask the broker directly
+        meta = consumer.list_topics(topic, timeout=METADATA_TIMEOUT).topics.get(topic)
+        if meta is None or meta.error is not None:
+            raise LookupError(topic)
+        partition_count = len(meta.partitions)
+    if partitions is None:
+        partitions = list(range(partition_count))
+    elif any(p < 0 or p >= partition_count for p in partitions):
+        raise ValueError(f"Topic '{topic}' has {partition_count} partition(s)")
+    bounds = {
+        p: consumer.get_watermark_offsets(TopicPartition(topic, p), timeout=METADATA_TIMEOUT)
+        for p in partitions
+    }
+    if position.cursor is not None:
+        starts = {p: position.cursor.get(p, bounds[p][0]) for p in partitions}
+    elif position.timestamp_ms is not None:
+        found = consumer.offsets_for_times(
+            [TopicPartition(topic, p, position.timestamp_ms) for p in partitions],
+            timeout=METADATA_TIMEOUT)
+        # No record at or after the timestamp: start at the end
+        starts = {tp.partition: tp.offset if tp.offset >= 0 else bounds[tp.partition][1]
+                  for tp in found}
+    elif position.offset is not None and position.offset >= 0:
+        starts = {p: position.offset for p in partitions}
+    else:
+        back = -position.offset if position.offset is not None else limit
+        starts = {p: bounds[p][1] - back for p in partitions}
+    starts = {p: min(max(o, bounds[p][0]), bounds[p][1]) for p, o in starts.items()}
+
+    pending = {p for p in partitions if starts[p] < bounds[p][1]}
+    records: Dict[int, list] = {p: [] for p in partitions}
+    error: Optional[KafkaError] = None
+    if pending:
+        consumer.assign([TopicPartition(topic, p, starts[p]) for p in pending])
+        paused: List[TopicPartition] = []
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                batch = consumer.consume(min(limit * len(pending), CONSUME_BATCH_SIZE), remaining)
+                done = []
+                for msg in batch:
+                    err = msg.error()
+                    if err:
+                        if err.code() != KafkaError._PARTITION_EOF:
+                            error = err
+                        continue
+                    p = msg.partition()
+                    if p not in pending:
+                        continue
+                    records[p].append(msg)
+                    if len(records[p]) >= limit or msg.offset() + 1 >= bounds[p][1]:
+                        pending.discard(p)
+                        done.append(TopicPartition(topic, p))
+                if done and pending:
+                    consumer.pause(done)
+                    paused.extend(done)
+                if error:
+                    break
+        finally:
+            # Pause state can outlive the assignment, and the pooled consumer is reused
+            if paused:
+                consumer.resume(paused)
+            consumer.unassign()
+
+    page = sorted((msg for msgs in records.values() for msg in msgs),
+                  key=lambda m: (m.timestamp()[1], m.partition(), m.offset()))
+    if position == ReplayPosition():
+        # No start given: the newest records, and a cursor for what arrives next
+        page = page[-limit:]
+        next_offsets = {p: bounds[p][1] for p in partitions}
+    else:
+        page = page[:limit]
+        next_offsets = dict(starts)
+    out = []
+    for msg in page:
+        next_offsets[msg.partition()] = max(next_offsets[msg.partition()], msg.offset() + 1)
+        try:
+            value = (codec or record_codec(parse_headers(msg.headers()), value_codec)).decode(msg.value())
+        except Exception:
+            # Replay is for debugging and backfill: show undecodable values as text
+            value = (msg.value() or b"").decode("utf-8", "replace")
+        key = msg.key()
+        out.append(MessageInfo(
+            topic=topic,
+            partition=msg.partition(),
+            offset=msg.offset(),
+            key=key.decode() if key else None,
+            value=value,
+            timestamp=datetime.fromtimestamp(msg.timestamp()[1] / 1000).isoformat()
+        ))
+    return {
+        "messages": out,
+        "next_cursor": format_cursor(next_offsets),
+        "end_of_topic": all(next_offsets[p] >= bounds[p][1] for p in partitions),
+        "error": str(error) if error else None,
+    }
+
+CHAT_MESSAGE = "chat_message"
+
+# ─── Chat history ─────────────────────────────────────────────────────────────
+# Recent chat messages kept per room; new WebSocket joins and /chat/messages read these
+CHAT_HISTORY_SIZE = int(os.getenv('CHAT_HISTORY_SIZE', '1000'))
+
+class HistoryEntry:
+    __slots__ = ("message_id", "partition", "offset", "info", "seq", "_frame")
+
+    def __init__(self, message_id: Optional[str], partition: int, offset: int,
+                 info: Dict[str, Any]):
+        self.message_id = message_id
+        self.partition = partition
+        self.offset = offset
+        self.info = info
+        self.seq = -1
+        self._frame: Optional["Frame"] = None
+
+    @property
+    def frame(self) -> "Frame":
+        """The chat_message WebSocket frame, shared by every replay."""
+        if self._frame is None:
+            self._frame = Frame(self.info["value"])
+        return self._frame
+
+class RoomHistory:
+    """
+    Fixed-size ring of a room's most recent chat messages.
+
+    Entries get increasing sequence numbers; slot = seq % capacity, and the
+    message_id and (partition, offset) indexes map to sequence numbers, so
+    "messages after X" is a dict lookup plus a slice. Only the event loop
+    thread touches it.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._slots: List[Optional[HistoryEntry]] = [None] * capacity
+        self._next = 0
+        self._by_id: Dict[str, int] = {}
+        self._by_offset: Dict[Tuple[int, int], int] = {}
+
+    def __len__(self) -> int:
+        return min(self._next, self.capacity)
+
+    @property
+    def _oldest(self) -> int:
+        return max(0, self._next - self.capacity)
+
+    def append(self, entry: HistoryEntry) -> bool:
+        """Add a message; redelivered records (same partition/offset) are ignored."""
+        position = (entry.partition, entry.offset)
+        if position in self._by_offset:
+            return False
+        seq = self._next
+        slot = seq % self.capacity
+        old = self._slots[slot]
+        if old is not None:
+            if self._by_id.get(old.message_id) == seq - self.capacity:
+                del self._by_id[old.message_id]
+            del self._by_offset[(old.partition, old.offset)]
+        entry.seq = seq
+        self._slots[slot] = entry
+        if entry.message_id:
+            self._by_id[entry.message_id] = seq
+        self._by_offset[position] = seq
+        self._next = seq + 1
         return True
-    except Exception as e:
-        logger.error(f"Kafka health check failed: {e}")
-        return False
+
+    def _range(self, start: int, limit: int) -> List[HistoryEntry]:
+        start = max(start, self._oldest)
+        end = min(self._next, start + max(limit, 0))
+        return [self._slots[seq % self.capacity] for seq in range(start, end)]
+
+    def tail(self, limit: int) -> List[HistoryEntry]:
+        return self._range(self._next - limit, limit)
+
+    def after(self, seq: int, limit: int) -> List[HistoryEntry]:
+        """Entries appended after the one with sequence number seq."""
+        return self._range(seq + 1, limit)
+
+    def since(self, message_id: str, limit: int) -> Tuple[List[HistoryEntry], bool, bool]:
+        """
+        Messages after message_id, oldest first: (entries, has_more, gap).
+
+        gap is True when message_id is no longer (or never was) buffered;
+        the page then starts at the oldest buffered message.
+        """
+        seq = self._by_id.get(message_id)
+        gap = seq is None
+        start = self._oldest if gap else seq + 1
+        entries = self._range(start, limit)
+        return entries, start + len(entries) < self._next, gap
+
+chat_history: Dict[str, RoomHistory] = {}
+
+def room_history(room: str) -> RoomHistory:
+    history = chat_history.get(room)
+    if history is None:
+        # At least one slot: the ring also tells redelivered records apart
+        history = chat_history[room] = RoomHistory(max(CHAT_HISTORY_SIZE, 1))
+    return history
+
+# ─── Topic streams ────────────────────────────────────────────────────────────
+# Recent records kept per streamed topic for Last-Event-ID resume
+STREAM_REPLAY_SIZE = int(os.getenv('STREAM_REPLAY_SIZE', '1000'))
+# Encoded events buffered per stream before the stream is closed as too slow
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '1000'))
+STREAM_FORMATS = ("sse", "ndjson")
+
+class StreamEvent:
+    """One record of a streamed topic; encoded at most once per format."""
+
+    __slots__ = ("partition", "offset", "record", "_sse", "_ndjson")
+
+    def __init__(self, partition: int, offset: int, record: Dict[str, Any]):
+        self.partition = partition
+        self.offset = offset
+        self.record = record
+        self._sse: Optional[bytes] = None
+        self._ndjson: Optional[bytes] = None
+
+    @property
+    def id(self) -> str:
+        return f"{self.partition}:{self.offset}"
+
+    def encode(self, fmt: str) -> bytes:
+        if fmt == "sse":
+            if self._sse is None:
+                self._sse = f"id: {self.id}\ndata: {dumps_text(self.record)}\n\n".encode()
+            return self._sse
+        if self._ndjson is None:
+            self._ndjson = (dumps_text({"id": self.id, **self.record}) + "\n").encode()
+        return self._ndjson
+
+class TopicStream:
+    """A streaming HTTP client: encoded events waiting to be written."""
+
+    __slots__ = ("topic", "fmt", "queue", "wakeup", "overflowed")
+
+    def __init__(self, topic: str, fmt: str):
+        self.topic = topic
+        self.fmt = fmt
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, event: StreamEvent):
+        if self.overflowed:
+            return
+        if len(self.queue) >= STREAM_QUEUE_SIZE:
+            # The client resumes from Last-Event-ID instead of us buffering more
+            self.overflowed = True
+            STREAM_OVERFLOWS.inc()
+        else:
+            self.queue.append(event.encode(self.fmt))
+        self.wakeup.set()
+
+class StreamHub:
+    """
+    Streams per topic, fed from the shared WebSocket consumer.
+
+    Each streamed topic keeps its last STREAM_REPLAY_SIZE records in arrival
+    order. Every stream of a topic sees that same order, so a Last-Event-ID
+    of partition:offset identifies exactly where a client left off.
+    """
+
+    def __init__(self):
+        self.streams: Dict[str, Set[TopicStream]] = {}
+        self.recent: Dict[str, deque] = {}
+        # Highest offset buffered per partition, so re-read records are not repeated
+        self.buffered: Dict[str, Dict[int, int]] = {}
+
+    @staticmethod
+    def parse_event_id(last_event_id: Optional[str]) -> Optional[Tuple[int, int]]:
+        """(partition, offset) of a Last-Event-ID, or None when there is none."""
+        if not last_event_id:
+            return None
+        try:
+            partition, offset = (int(part) for part in last_event_id.split(":"))
+        except ValueError:
+            raise HTTPException(400, "Last-Event-ID must be partition:offset")
+        return partition, offset
+
+    def open(self, topic: str, fmt: str, after: Optional[Tuple[int, int]],
+             history: int) -> Tuple[TopicStream, List[StreamEvent], bool]:
+        """Register a stream; returns it with the events to replay first and a gap flag."""
+        replay, gap = self._replay(self.buffer(topic), after, history)
+        stream = TopicStream(topic, fmt)
+        self.streams.setdefault(topic, set()).add(stream)
+        return stream, replay, gap
+
+    def buffer(self, topic: str) -> deque:
+        """The replay buffer of topic, created on first use from the room's chat history."""
+        recent = self.recent.get(topic)
+        if recent is None:
+            recent = self.recent[topic] = deque(maxlen=STREAM_REPLAY_SIZE)
+            buffered = self.buffered[topic] = {}
+            history = chat_history.get(topic)
+            if history is not None:
+                for entry in history.tail(STREAM_REPLAY_SIZE):
+                    recent.append(StreamEvent(entry.partition, entry.offset, entry.info))
+                    buffered[entry.partition] = max(entry.offset, buffered.get(entry.partition, -1))
+        return recent
+
+    @staticmethod
+    def _replay(recent: deque, after: Optional[Tuple[int, int]],
+                history: int) -> Tuple[List[StreamEvent], bool]:
+        if after is None:
+            return (list(recent)[-history:] if history > 0 else []), False
+        partition, offset = after
+        events = list(recent)
+        for i in range(len(events) - 1, -1, -1):
+            if events[i].partition == partition and events[i].offset == offset:
+                return events[i + 1:], False
+        # No longer buffered: send what is, skipping what that partition already delivered
+        return [e for e in events if e.partition != partition or e.offset > offset], True
+
+    def close(self, stream: TopicStream):
+        members = self.streams.get(stream.topic)
+        if members is not None:
+            members.discard(stream)
+            if not members:
+                del self.streams[stream.topic]
+
+    def drop_topic(self, topic: str):
+        """Forget the replay buffer of a topic the consumer no longer reads."""
+        if topic not in self.streams:
+            self.recent.pop(topic, None)
+            self.buffered.pop(topic, None)
+
+    def publish(self, msg, value: Any, live: bool):
+        """Buffer a record of a streamed topic; send it to the streams if it is new."""
+        recent = self.recent.get(msg.topic())
+        if recent is None:
+            return
+        # Records read again after a rebalance are already buffered (and were streamed)
+        buffered = self.buffered[msg.topic()]
+        if msg.offset() <= buffered.get(msg.partition(), -1):
+            return
+        buffered[msg.partition()] = msg.offset()
+        key = msg.key()
+        event = StreamEvent(msg.partition(), msg.offset(), {
+            "topic": msg.topic(),
+            "partition": msg.partition(),
+            "offset": msg.offset(),
+            "key": key.decode() if key else None,
+            "value": value,
+            "timestamp": datetime.utcnow().isoformat()
+        })
+        recent.append(event)
+        if live:
+            for stream in self.streams.get(msg.topic(), ()):
+                stream.push(event)
+
+stream_hub = StreamHub()
+
+# ─── Delivery tracing ─────────────────────────────────────────────────────────
+# Fraction of chat messages (by trace-id header) whose delivery stages are timed
+WS_TRACE_SAMPLE_RATE = float(os.getenv('WS_TRACE_SAMPLE_RATE', '0.01'))
+TRACE_STAGES = ("broker", "handoff", "decode", "enqueue", "write", "total")
+
+class DeliveryTrace:
+    """
+    Timings of one sampled chat message from produce to its last socket write.
+
+    pending counts the client queues holding a frame with this message;
+    each completed send decrements it, and the last one closes the trace.
+    Frames dropped from a full queue never complete, so neither does the trace.
+    """
+
+    __slots__ = ("tracer", "room", "produced_at", "enqueued_at", "pending", "awaiting_batch")
+
+    def __init__(self, tracer: "DeliveryTracer", room: str, produced_at: float):
+        self.tracer = tracer
+        self.room = room
+        self.produced_at = produced_at
+        self.enqueued_at: Optional[float] = None
+        self.pending = 0
+        self.awaiting_batch = False
+
+    def enqueued(self, started: float):
+        """deliver() has queued the message (or added it to a pending chat_batch)."""
+        self.enqueued_at = time.perf_counter()
+        self.tracer.observe(self.room, "enqueue", self.enqueued_at - started)
+        self._maybe_finish()
+
+    def batch_queued(self, queued: int):
+        """The chat_batch holding the message went to queued clients."""
+        self.pending += queued
+        self.awaiting_batch = False
+        self._maybe_finish()
+
+    def sent(self):
+        self.pending -= 1
+        self._maybe_finish()
+
+    def _maybe_finish(self):
+        if self.pending > 0 or self.awaiting_batch or self.enqueued_at is None:
+            return
+        # Write includes the chat_batch window for batched clients
+        self.tracer.observe(self.room, "write", time.perf_counter() - self.enqueued_at)
+        self.tracer.observe(self.room, "total", time.time() - self.produced_at)
+        # Only the first completion counts
+        self.enqueued_at = None
+
+class DeliveryTracer:
+    """
+    Samples chat messages by trace id and records their stage latencies.
+
+    Stages go to the ws_delivery_stage_seconds histogram and to an in-memory
+    histogram per room (served by /chat/latency, never scraped, so room names
+    add no label cardinality). Sampling on the producer's trace id means every
+    worker traces the same messages.
+    """
+
+    def __init__(self, sample_rate: float):
+        self.threshold = int(min(max(sample_rate, 0.0), 1.0) * 0xFFFFFFFF)
+        self.rooms: Dict[str, Histogram] = {}
+
+    def sampled(self, trace_id: Optional[str]) -> bool:
+        if not trace_id or not self.threshold:
+            return False
+        try:
+            return int(trace_id[:8], 16) <= self.threshold
+        except ValueError:
+            return False
+
+    def start(self, room: str, produced_at_ms: int, polled_at: float,
+              handoff: float) -> DeliveryTrace:
+        """Open a trace for a record consume()d at polled_at (wall clock)."""
+        produced_at = produced_at_ms / 1000
+        # Clocks of the producer and consumer hosts may disagree slightly
+        self.observe(room, "broker", max(polled_at - produced_at, 0.0))
+        self.observe(room, "handoff", handoff)
+        return DeliveryTrace(self, room, produced_at)
+
+    def observe(self, room: str, stage: str, seconds: float):
+        WS_DELIVERY_STAGE.labels(stage).observe(seconds)
+        histogram = self.rooms.get(room)
+        if histogram is None:
+            histogram = self.rooms[room] = Histogram(
+                "ws_room_delivery_stage_seconds", "", ("stage",), buckets=TRACE_BUCKETS)
+        histogram.labels(stage).observe(seconds)
+
+    def drop_room(self, room: str):
+        self.rooms.pop(room, None)
+
+    def summary(self, room: str) -> Dict[str, Any]:
+        """Count, mean and estimated percentiles (ms) per stage for room."""
+        histogram = self.rooms.get(room)
+        out: Dict[str, Any] = {}
+        if histogram is None:
+            return out
+        for stage in TRACE_STAGES:
+            child = histogram.labels(stage)
+            if not child.count:
+                continue
+            out[stage] = {
+                "count": child.count,
+                "mean_ms": round(child.sum / child.count * 1000, 3),
+                "p50_ms": round(child.quantile(0.5) * 1000, 3),
+                "p95_ms": round(child.quantile(0.95) * 1000, 3),
+                "p99_ms": round(child.quantile(0.99) * 1000, 3),
+            }
+        return out
+
+tracer = DeliveryTracer(WS_TRACE_SAMPLE_RATE)
 
 # ─── FastAPI app ───────────────────────────────────────────────────────────────
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    await on_startup()
+    try:
+        yield
+    finally:
+        await on_shutdown()
+
 app = FastAPI(
     title="Kafka Consumer API",
     description="HTTP API for consuming messages from Kafka topics + WebSocket chat",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -99,115 +1041,848 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-endpoint latency histograms for /metrics
+app.add_middleware(RequestMetricsMiddleware, histogram=REQUEST_LATENCY)
+
 templates = Jinja2Templates(directory="consumers/templates")
 
 # ─── WebSocket manager ────────────────────────────────────────────────────────
+# Subprotocols a client may ask for in Sec-WebSocket-Protocol, and whether
+# each uses binary frames. Without one, frames are JSON text.
+MSGPACK = CODECS.get("msgpack")
+WS_PROTOCOLS = {"chat.json": False}
+if MSGPACK is not None:
+    WS_PROTOCOLS["chat.msgpack"] = True
+# permessage-deflate for clients that offer it (compresses per connection)
+WS_PER_MESSAGE_DEFLATE = os.getenv('WS_PER_MESSAGE_DEFLATE', 'true').lower() == 'true'
+
+class Frame:
+    """
+    One outbound WebSocket message, serialized at most once per encoding.
+
+    A broadcast queues the same Frame for every client in the room; each
+    writer asks for its own protocol's bytes, which are computed on first
+    use and then shared.
+    """
+
+    __slots__ = ("obj", "traces", "_text", "_binary")
+
+    def __init__(self, obj: Any, traces: Optional[List[DeliveryTrace]] = None):
+        self.obj = obj
+        # Sampled messages in this frame, told when each client's copy is sent
+        self.traces = traces
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = dumps_text(self.obj)
+        return self._text
+
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = MSGPACK.encode(self.obj)
+        return self._binary
+
+HEARTBEAT_FRAME = Frame({"type": "heartbeat"})
+HEARTBEAT_INTERVAL = 15
+# Outbound frames buffered per client, and what to do when a client falls behind:
+# drop_oldest, drop_client, or coalesce (replace stale presence/heartbeat frames first)
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', '256'))
+WS_OVERFLOW_POLICY = os.getenv('WS_OVERFLOW_POLICY', 'drop_oldest')
+# A single send taking longer than this evicts the client
+WS_SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT', '10'))
+OVERFLOW_POLICIES = ("drop_oldest", "drop_client", "coalesce")
+if WS_OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(f"WS_OVERFLOW_POLICY must be one of {', '.join(OVERFLOW_POLICIES)}")
+# Each room is a Kafka topic, so room names follow topic naming rules
+DEFAULT_ROOM = "anonymous-anime-universe"
+ROOM_NAME = re.compile(r"^[A-Za-z0-9._-]{1,249}$")
+WS_MAX_ROOMS = int(os.getenv('WS_MAX_ROOMS', '1000'))
+# A room's topic stays subscribed this long after its last member leaves
+WS_ROOM_LINGER_SECONDS = float(os.getenv('WS_ROOM_LINGER_SECONDS', '30'))
+# Longest a first join to a room waits for its history backfill before replaying
+WS_BACKFILL_WAIT = float(os.getenv('WS_BACKFILL_WAIT_SECONDS', '5'))
+# Worker processes sharing the port; with more than one, each worker reads
+# every message in its own group and room counts are summed across workers
+WS_WORKERS = int(os.getenv('WS_WORKERS', '1'))
+WS_CONSUMER_GROUP = os.getenv('WS_CONSUMER_GROUP', 'ws-chat-group')
+# Every replica must read every message too, so the group also names the
+# instance; set a stable WS_INSTANCE_ID where hostnames change on restart
+WS_INSTANCE_ID = os.getenv('WS_INSTANCE_ID') or socket.gethostname()
+# Clients connecting with ?batch=1 get one chat_batch frame per room per window
+WS_BATCH_WINDOW = float(os.getenv('WS_BATCH_WINDOW_MS', '20')) / 1000
+WS_BATCH_MAX_MESSAGES = int(os.getenv('WS_BATCH_MAX_MESSAGES', '100'))
+# connection_update frames go out at most once per room per interval
+WS_PRESENCE_DEBOUNCE = float(os.getenv('WS_PRESENCE_DEBOUNCE_MS', '500')) / 1000
+# Background consumer: records per consume() call, poll timeout, and how many
+# batches may wait for the event loop before the poll thread pauses. A batch
+# is delivered in one go, so keep it below WS_SEND_QUEUE_SIZE.
+WS_CONSUME_BATCH_SIZE = int(os.getenv('WS_CONSUME_BATCH_SIZE', '100'))
+WS_POLL_TIMEOUT = float(os.getenv('WS_POLL_TIMEOUT', '0.5'))
+WS_POLL_QUEUE_BATCHES = int(os.getenv('WS_POLL_QUEUE_BATCHES', '4'))
+# Offsets of the background consumer: "manual" commits what was handed to
+# clients, coalesced per partition every WS_COMMIT_EVERY records or
+# WS_COMMIT_INTERVAL_MS; "auto" leaves it to librdkafka's commit timer
+WS_COMMIT_MODE = os.getenv('WS_COMMIT_MODE', 'manual')
+WS_COMMIT_EVERY = int(os.getenv('WS_COMMIT_EVERY', '500'))
+WS_COMMIT_INTERVAL = float(os.getenv('WS_COMMIT_INTERVAL_MS', '1000')) / 1000
+if WS_COMMIT_MODE not in ("auto", "manual"):
+    raise ValueError("WS_COMMIT_MODE must be auto or manual")
+
+class ClientConnection:
+    """
+    Outbound side of one WebSocket: a bounded frame queue drained by a writer task.
+
+    enqueue() never awaits, so a broadcast costs O(clients) appends no matter
+    how slow any socket is. Frames may carry a coalesce key; under the
+    coalesce policy a newer keyed frame replaces a queued one with the same
+    key, and keyed frames are the first to go when the queue is full.
+    """
+
+    __slots__ = ("websocket", "manager", "room", "batched", "binary", "queue", "wakeup", "task",
+                 "closed")
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager", room: str,
+                 batched: bool = False, binary: bool = False):
+        self.websocket = websocket
+        self.manager = manager
+        self.room = room
+        self.batched = batched
+        self.binary = binary
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    async def send(self, frame: Frame):
+        """Send one frame in this client's encoding."""
+        if self.binary:
+            data = frame.binary()
+            WS_SENT_BYTES.labels("msgpack").inc(len(data))
+            await self.websocket.send_bytes(data)
+        else:
+            data = frame.text()
+            WS_SENT_BYTES.labels("json").inc(len(data))
+            await self.websocket.send_text(data)
+
+    def enqueue(self, frame: Frame, key: Optional[str] = None) -> bool:
+        if self.closed:
+            return False
+        queue = self.queue
+        if key is not None and WS_OVERFLOW_POLICY == "coalesce":
+            for i, (queued_key, _) in enumerate(queue):
+                if queued_key == key:
+                    queue[i] = (key, frame)
+                    WS_FRAMES_DROPPED.labels("coalesced").inc()
+                    return True
+        if len(queue) >= WS_SEND_QUEUE_SIZE:
+            if WS_OVERFLOW_POLICY == "drop_client":
+                self.manager.evict(self, "overflow")
+                return False
+            if WS_OVERFLOW_POLICY == "coalesce" and self._drop_keyed():
+                WS_FRAMES_DROPPED.labels("coalesced").inc()
+            else:
+                queue.popleft()
+                WS_FRAMES_DROPPED.labels("overflow").inc()
+        queue.append((key, frame))
+        self.wakeup.set()
+        return True
+
+    def _drop_keyed(self) -> bool:
+        for i, (queued_key, _) in enumerate(self.queue):
+            if queued_key is not None:
+                del self.queue[i]
+                return True
+        return False
+
+    async def _writer(self):
+        """Drain the queue; send a heartbeat after HEARTBEAT_INTERVAL s of silence."""
+        send = self.send
+        queue = self.queue
+        try:
+            while True:
+                if not queue:
+                    self.wakeup.clear()
+                    try:
+                        async with asyncio.timeout(HEARTBEAT_INTERVAL):
+                            await self.wakeup.wait()
+                    except TimeoutError:
+                        queue.append(("heartbeat", HEARTBEAT_FRAME))
+                    continue
+                _, frame = queue.popleft()
+                async with asyncio.timeout(WS_SEND_TIMEOUT):
+                    await send(frame)
+                if frame.traces is not None:
+                    for trace in frame.traces:
+                        trace.sent()
+        except TimeoutError:
+            self.manager.evict(self, "send_timeout")
+        except Exception:
+            # Send failed: the socket is gone. Never broadcast from here.
+            WS_SEND_FAILURES.inc()
+            self.manager.evict(self, None)
+
 class ConnectionManager:
+    """
+    WebSocket clients indexed by room, fed by one background consumer.
+
+    The consumer is subscribed to the default room plus every room that has
+    members (or lost its last one less than WS_ROOM_LINGER_SECONDS ago), so
+    each Kafka record is fanned out only to the clients of its own room.
+    With several workers, presence adds the other workers' room counts.
+
+    Batched clients get chat messages collected for up to WS_BATCH_WINDOW
+    (or WS_BATCH_MAX_MESSAGES) as one chat_batch frame, encoded once per room.
+
+    Joins and leaves only bump a per-room counter and mark the room dirty;
+    a debounced flush sends one connection_update per changed room, so a
+    reconnect storm costs O(clients) sends instead of O(clients²).
+
+    In manual commit mode, offsets are committed only after their records
+    were handed to the clients' queues (at-least-once). The loop coalesces
+    them per partition and the poll thread commits them asynchronously.
+    """
+
     def __init__(self):
-        self.active_connections: Set[WebSocket] = set()
-        self.lock = asyncio.Lock()
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self.rooms: Dict[str, Set[ClientConnection]] = {}
+        # Rooms whose last member left, with the time it happened
+        self.empty_since: Dict[str, float] = {}
+        # Local clients per room, the count each room was last told, and rooms to tell again
+        self.room_sizes: Dict[str, int] = defaultdict(int)
+        self.presence_sent: Dict[str, int] = {}
+        self.presence_dirty: Set[str] = set()
+        self.presence_flush: Optional[asyncio.TimerHandle] = None
+        # Batched clients per room, and the messages waiting for their next frame
+        self.batch_members: Dict[str, int] = defaultdict(int)
+        self.pending_batches: Dict[str, List[Any]] = {}
+        self.pending_traces: Dict[str, List[DeliveryTrace]] = {}
+        self.flush_handles: Dict[str, asyncio.TimerHandle] = {}
+        self.subscribed: Set[str] = set()
+        # Topics this process unsubscribed from; their committed offsets are stale
+        self.closed_topics: Set[str] = set()
+        # Reopened topics awaiting assignment; they go live at their end
+        self.fresh_topics: Set[str] = set()
+        self.presence: Optional[PresenceBoard] = None
+        self.presence_task: Optional[asyncio.Task] = None
+        # Per-worker group when WS_WORKERS > 1, chosen at startup
+        self.group_id = f"{WS_CONSUMER_GROUP}-{WS_INSTANCE_ID}"
         self.consumer: Optional[Consumer] = None
         self.is_consuming = False
-        self.keepalive_tasks: Dict[WebSocket, asyncio.Task] = {}
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        async with self.lock:
-            self.active_connections.add(websocket)
-        # start a keepalive "ping"
-        task = asyncio.create_task(self._keepalive(websocket))
-        self.keepalive_tasks[websocket] = task
-        logger.info(f"Client connected ({len(self.active_connections)} total)")
-        
-        # Send immediate connection update to the new client
-        connection_update = {
-            "type": "connection_update",
-            "active_connections": len(self.active_connections),
-            "room": "anonymous-anime-universe",
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        await websocket.send_text(json.dumps(connection_update))
-        
-        # Broadcast connection update to all clients
-        await self._broadcast_connection_update()
+        self.poll_thread: Optional[threading.Thread] = None
+        self.dispatch_task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stop_polling = threading.Event()
+        self.batch_slots = threading.BoundedSemaphore(WS_POLL_QUEUE_BATCHES)
+        # Topic list for the poll thread to subscribe to, set by the event loop
+        self.pending_subscription: Optional[Set[str]] = None
+        self.subscription_lock = threading.Lock()
+        # First offset per (topic, partition) to broadcast; earlier ones only fill history
+        self.live_from: Dict[Tuple[str, int], int] = {}
+        # Read positions saved when a rebalance revoked partitions (poll thread only)
+        self.resume_at: Dict[Tuple[str, int], int] = {}
+        # History backfill in progress: end offset per partition, and the
+        # replays waiting for their topic's backfill to be dispatched
+        self.backfilling: Dict[Tuple[str, int], int] = {}
+        self.backfill_waiters: Dict[str, asyncio.Future] = {}
+        # When the batch being dispatched was polled: wall clock, perf_counter
+        self.polled_at: Tuple[float, float] = (0.0, 0.0)
+        # Manual commits: next offset per partition fanned out since the last
+        # commit request, and the offsets waiting for the poll thread
+        self.fanned_out: Dict[Tuple[str, int], int] = {}
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+        self.pending_commit: Optional[Dict[Tuple[str, int], int]] = None
+
+    async def connect(self, websocket: WebSocket, room: str = DEFAULT_ROOM,
+                      since: Optional[str] = None, history: int = 0,
+                      batched: bool = False) -> bool:
+        """Accept and join room; returns False if the connection was refused."""
+        if not ROOM_NAME.match(room):
+            await websocket.close(code=1008)
+            return False
+        if room not in self.rooms and len(self.rooms) >= WS_MAX_ROOMS:
+            logger.warning(f"Refusing WebSocket client: {WS_MAX_ROOMS} rooms already open")
+            await websocket.close(code=1013)
+            return False
+        # The first offered subprotocol we support wins; none means JSON text
+        protocol = next((p for p in websocket.scope.get("subprotocols", ())
+                         if p in WS_PROTOCOLS), None)
+        await websocket.accept(subprotocol=protocol)
+        client = ClientConnection(websocket, self, room, batched,
+                                  binary=WS_PROTOCOLS.get(protocol, False))
+        if since or history > 0:
+            await self.wait_backfill(room)
+        await self._replay_and_join(client, since, history)
+        client.start()
+        if room not in self.subscribed and self.is_consuming:
+            self.update_subscription()
+        logger.info(f"Client connected to {room} ({self.room_count(room)} in room, "
+                    f"{len(self.active_connections)} on this worker)")
+
+        # The new client learns the count now; the rest of the room on the next flush
+        client.enqueue(self._presence_frame(room), "presence")
+        self.mark_presence(room)
+        return True
+
+    async def _replay_and_join(self, client: ClientConnection,
+                               since: Optional[str], history: int):
+        """
+        Send buffered messages after since (or the last history ones), then
+        start live delivery. Joining happens in the same step as the final
+        empty history check, so no message is missed or sent twice.
+        """
+        buffered = chat_history.get(client.room)
+        if buffered is not None and since:
+            entries, _, _ = buffered.since(since, CHAT_HISTORY_SIZE)
+        elif buffered is not None and history > 0:
+            entries = buffered.tail(min(history, CHAT_HISTORY_SIZE))
+        else:
+            entries = []
+        while entries:
+            if client.batched:
+                await client.send(Frame({
+                    "type": "chat_batch",
+                    "room": client.room,
+                    "messages": [entry.info["value"] for entry in entries],
+                }))
+            else:
+                for entry in entries:
+                    await client.send(entry.frame)
+            entries = buffered.after(entries[-1].seq, CHAT_HISTORY_SIZE)
+        if client.batched:
+            # The pending batch holds messages the replay already sent
+            self._flush_batch(client.room)
+            self.batch_members[client.room] += 1
+        self.active_connections[client.websocket] = client
+        self.rooms.setdefault(client.room, set()).add(client)
+        self.room_sizes[client.room] += 1
+        self.empty_since.pop(client.room, None)
+
+    async def wait_backfill(self, topic: str):
+        """
+        Subscribe topic if it is not yet, and wait until the history that
+        _on_assign rewinds for it has been dispatched, so the first replay
+        of a cold room is not empty. Topics missing from the metadata cache
+        have nothing to backfill.
+        """
+        waiter = self.backfill_waiters.get(topic)
+        if waiter is None:
+            if topic in self.subscribed or not self.is_consuming \
+                    or topic not in metadata_cache.topics:
+                return
+            waiter = self.backfill_waiters[topic] = asyncio.get_running_loop().create_future()
+            # Keep the topic subscribed, like an emptied room, until the caller joins it
+            self.empty_since.setdefault(topic, time.monotonic())
+            self.update_subscription()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), WS_BACKFILL_WAIT)
+        except asyncio.TimeoutError:
+            logger.warning(f"History backfill of {topic} not done after {WS_BACKFILL_WAIT:g}s")
+            self._finish_backfill(topic)
+
+    def _finish_backfill(self, topic: str):
+        for key in [key for key in self.backfilling if key[0] == topic]:
+            del self.backfilling[key]
+        waiter = self.backfill_waiters.pop(topic, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
 
-    async def _broadcast_connection_update(self):
-        """Broadcast current connection count to all clients."""
+    def _backfill_assigned(self, topics: Set[str], ends: Dict[Tuple[str, int], int]):
+        """Event loop side of _on_assign: track which new partitions are still rewinding."""
+        self.backfilling.update(ends)
+        for topic in topics:
+            if not any(key[0] == topic for key in self.backfilling):
+                self._finish_backfill(topic)
+
+    def _track_backfill(self, msgs):
+        """Finish the backfill of topics whose rewound records have all been dispatched."""
+        finished = set()
+        for msg in msgs:
+            if msg.error():
+                continue
+            key = (msg.topic(), msg.partition())
+            end = self.backfilling.get(key)
+            if end is not None and msg.offset() + 1 >= end:
+                del self.backfilling[key]
+                finished.add(key[0])
+        for topic in finished:
+            if not any(key[0] == topic for key in self.backfilling):
+                self._finish_backfill(topic)
+
+    def _presence_frame(self, room: str) -> Frame:
         connection_update = {
             "type": "connection_update",
-            "active_connections": len(self.active_connections),
-            "room": "anonymous-anime-universe",
+            "active_connections": self.room_count(room),
+            "room": room,
             "timestamp": datetime.utcnow().isoformat()
         }
-        await self.broadcast(json.dumps(connection_update))
-        logger.info(f"📡 Broadcasted connection update: {len(self.active_connections)} users online")
+        return Frame(connection_update)
 
-    async def _keepalive(self, websocket: WebSocket):
-        """Send an application‐level heartbeat every 15 s so the WS stays open."""
-        try:
-            while True:
-                await asyncio.sleep(15)
-                await websocket.send_text(json.dumps({"type": "heartbeat"}))
-        except Exception:
-            # if send fails, assume disconnected
-            await self.disconnect(websocket)
-
-    async def disconnect(self, websocket: WebSocket):
-        """Remove client and cancel its keepalive task."""
-        async with self.lock:
-            self.active_connections.discard(websocket)
-        task = self.keepalive_tasks.pop(websocket, None)
-        if task:
-            task.cancel()
+    def mark_presence(self, room: str):
+        """Schedule a connection_update for room; repeated calls within the interval coalesce."""
+        self.presence_dirty.add(room)
+        if self.presence_flush is None:
+            self.presence_flush = asyncio.get_running_loop().call_later(
+                WS_PRESENCE_DEBOUNCE, self._flush_presence)
+
+    def _flush_presence(self):
+        """Send each changed room its connection count, once."""
+        self.presence_flush = None
+        dirty, self.presence_dirty = self.presence_dirty, set()
+        for room in dirty:
+            if room not in self.rooms:
+                self.presence_sent.pop(room, None)
+                continue
+            count = self.room_count(room)
+            if self.presence_sent.get(room) == count:
+                continue
+            self.presence_sent[room] = count
+            self.broadcast(room, self._presence_frame(room), key="presence")
+
+    def evict(self, client: ClientConnection, reason: Optional[str]):
+        """Drop a client from a sync context (overflow, failed or stuck send)."""
+        if client.closed:
+            return
+        # Stop queueing now; the rest of the frames in flight are dropped
+        client.closed = True
+        if reason:
+            WS_CLIENTS_EVICTED.labels(reason).inc()
+            logger.warning(f"Evicting slow WebSocket client ({reason})")
+        asyncio.get_running_loop().create_task(self.disconnect(client.websocket, close=True))
+
+    async def disconnect(self, websocket: WebSocket, close: bool = False):
+        """Remove client and stop its writer task."""
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        client.closed = True
+        if client.batched:
+            self.batch_members[client.room] -= 1
+            if not self.batch_members[client.room]:
+                del self.batch_members[client.room]
+        members = self.rooms.get(client.room)
+        if members is not None:
+            members.discard(client)
+            self.room_sizes[client.room] -= 1
+            if not members:
+                del self.rooms[client.room]
+                del self.room_sizes[client.room]
+                self.empty_since[client.room] = time.monotonic()
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
             with contextlib.suppress(asyncio.CancelledError):
-                await task
+                await client.task
+        if close:
+            # Ends the receive loop in ws_chat; 1013 = try again later
+            with contextlib.suppress(Exception):
+                await websocket.close(code=1013)
         logger.info(f"Client disconnected ({len(self.active_connections)} total)")
-        
-        # Broadcast connection update to remaining clients
-        await self._broadcast_connection_update()
-
-    async def broadcast(self, message: str):
-        """Send a JSON‐string message to all active connections."""
-        async with self.lock:
-            conns = list(self.active_connections)
-        for conn in conns:
+        self.mark_presence(client.room)
+
+    def broadcast(self, room: str, message: Frame, key: Optional[str] = None,
+                  batched: Optional[bool] = None) -> int:
+        """
+        Queue one shared frame for every client in room (never awaits
+        sockets). batched=True/False limits it to clients in that mode.
+        Returns how many clients took the frame (counted for traced frames only).
+        """
+        members = self.rooms.get(room)
+        if not members:
+            return 0
+        queued = 0
+        with WS_FANOUT_DURATION.labels().time():
+            if message.traces is not None:
+                for client in list(members):
+                    if batched is None or client.batched is batched:
+                        queued += client.enqueue(message, key)
+            elif batched is None:
+                for client in list(members):
+                    client.enqueue(message, key)
+            else:
+                for client in list(members):
+                    if client.batched is batched:
+                        client.enqueue(message, key)
+        WS_MESSAGES_BROADCAST.inc()
+        return queued
+
+    def deliver(self, room: str, payload: Dict[str, Any], trace: Optional[DeliveryTrace] = None):
+        """Send a chat message to room: its own frame now, or into the next chat_batch."""
+        members = self.rooms.get(room)
+        if not members:
+            return
+        started = time.perf_counter() if trace else 0.0
+        batched = self.batch_members.get(room, 0)
+        if batched < len(members):
+            frame = Frame({**payload, "active_connections": self.room_count(room)},
+                          [trace] if trace else None)
+            queued = self.broadcast(room, frame, batched=False if batched else None)
+            if trace:
+                trace.pending += queued
+        if batched:
+            pending = self.pending_batches.setdefault(room, [])
+            pending.append(payload)
+            if trace:
+                trace.awaiting_batch = True
+                self.pending_traces.setdefault(room, []).append(trace)
+            if len(pending) >= WS_BATCH_MAX_MESSAGES:
+                self._flush_batch(room)
+            elif len(pending) == 1:
+                self.flush_handles[room] = asyncio.get_running_loop().call_later(
+                    WS_BATCH_WINDOW, self._flush_batch, room)
+        if trace:
+            trace.enqueued(started)
+
+    def _flush_batch(self, room: str):
+        handle = self.flush_handles.pop(room, None)
+        if handle is not None:
+            handle.cancel()
+        messages = self.pending_batches.pop(room, None)
+        traces = self.pending_traces.pop(room, None)
+        if not messages:
+            return
+        WS_BATCH_SIZE.observe(len(messages))
+        frame = Frame({
+            "type": "chat_batch",
+            "room": room,
+            "active_connections": self.room_count(room),
+            "messages": messages,
+        }, traces)
+        queued = self.broadcast(room, frame, batched=True)
+        for trace in traces or ():
+            trace.batch_queued(queued)
+
+    def local_room_counts(self) -> Dict[str, int]:
+        return dict(self.room_sizes)
+
+    def room_count(self, room: str) -> int:
+        """Clients in room across all workers."""
+        remote = self.presence.remote.get(room, 0) if self.presence else 0
+        return self.room_sizes.get(room, 0) + remote
+
+    def room_counts(self) -> Dict[str, int]:
+        counts = dict(self.presence.remote) if self.presence else {}
+        for room, n in self.room_sizes.items():
+            counts[room] = counts.get(room, 0) + n
+        return counts
+
+    async def run_presence(self):
+        """Exchange room counts with the other workers; tell local rooms when theirs change."""
+        while True:
             try:
-                await conn.send_text(message)
-            except Exception:
-                await self.disconnect(conn)
+                self.presence.publish(self.local_room_counts())
+                before = self.presence.remote
+                after = self.presence.refresh()
+                for room in self.rooms.keys() & (before.keys() | after.keys()):
+                    if before.get(room) != after.get(room):
+                        self.mark_presence(room)
+            except Exception as e:
+                logger.error(f"Presence exchange failed: {e}")
+            await asyncio.sleep(PRESENCE_INTERVAL)
+
+    def wanted_topics(self) -> Set[str]:
+        """Rooms the background consumer should be subscribed to right now."""
+        now = time.monotonic()
+        for room, since in list(self.empty_since.items()):
+            if now - since >= WS_ROOM_LINGER_SECONDS:
+                del self.empty_since[room]
+        return {DEFAULT_ROOM, *self.rooms, *self.empty_since, *stream_hub.streams}
 
-    async def start_kafka_consumption(self):
-        """Background task: poll Kafka and broadcast chat_message events."""
+    def release_topic(self, topic: str):
+        """A stream of topic ended; let the topic linger like an empty room."""
+        if topic not in self.rooms and topic not in stream_hub.streams:
+            self.empty_since[topic] = time.monotonic()
+
+    def update_subscription(self):
+        """Hand the poll thread a new topic list if the set of open rooms changed."""
+        wanted = self.wanted_topics()
+        if wanted == self.subscribed:
+            return
+        self.fresh_topics |= (wanted - self.subscribed) & self.closed_topics
+        dropped = self.subscribed - wanted
+        self.closed_topics = (self.closed_topics | dropped) - wanted
+        self.subscribed = wanted
+        # Commit what was delivered before the poll thread leaves those partitions
+        self.request_commit(force=True)
+        with self.subscription_lock:
+            self.pending_subscription = wanted
+        # History of an unsubscribed room would go stale; /chat/messages reads Kafka instead
+        for topic in dropped:
+            self._finish_backfill(topic)
+            chat_history.pop(topic, None)
+            stream_hub.drop_topic(topic)
+            tracer.drop_room(topic)
+        for tp in list(self.live_from):
+            if tp[0] in dropped:
+                self.live_from.pop(tp, None)
+        logger.info(f"WS consumer subscribing to {len(wanted)} rooms")
+
+    def start_kafka_consumption(self):
+        """Start the poll thread and the task that dispatches its batches on the event loop."""
         if self.is_consuming or not self.consumer:
             return
         self.is_consuming = True
-        self.consumer.subscribe(['anonymous-anime-universe'])
-        loop = asyncio.get_event_loop()
+        self.stop_polling.clear()
+        self.update_subscription()
+        queue: asyncio.Queue = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        self.poll_thread = threading.Thread(
+            target=self._poll_loop, args=(asyncio.get_running_loop(), queue),
+            name="ws-chat-poll", daemon=True)
+        self.poll_thread.start()
+        self.dispatch_task = asyncio.create_task(self._dispatch(queue))
+        self.dispatch_task.add_done_callback(self._on_dispatch_done)
         logger.info("🔄 Starting background Kafka consumption for WS clients…")
 
-        while self.is_consuming:
-            # offload the blocking .poll() into a thread
-            msg = await loop.run_in_executor(None, self.consumer.poll, 1.0)
-            if not msg:
-                continue
+    def _on_dispatch_done(self, task: asyncio.Task):
+        if self.is_consuming:
+            logger.error(f"WS dispatch task stopped; chat delivery halted: {self.consumption_error()}")
+
+    def consumption_error(self) -> Optional[str]:
+        """Why WebSocket delivery has stopped, or None while it is running (or not started)."""
+        if not self.is_consuming:
+            return None
+        if not self.poll_thread.is_alive():
+            return "WS poll thread exited"
+        if self.dispatch_task.cancelled():
+            return "WS dispatch task was cancelled"
+        if self.dispatch_task.done():
+            return f"WS dispatch task failed: {self.dispatch_task.exception()!r}"
+        return None
+
+    async def stop_kafka_consumption(self):
+        """Stop polling and wait for the poll thread, so the consumer can be closed."""
+        if not self.is_consuming:
+            return
+        self.is_consuming = False
+        self.stop_polling.set()
+        await asyncio.to_thread(self.poll_thread.join)
+        self.dispatch_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.dispatch_task
+
+    def track_offsets(self, msgs):
+        """Note the records of a dispatched batch as fanned out (live ones only)."""
+        if WS_COMMIT_MODE != "manual":
+            return
+        for msg in msgs:
             if msg.error():
-                if msg.error().code() != KafkaError._PARTITION_EOF:
-                    logger.error(f"Kafka error: {msg.error()}")
                 continue
+            tp = (msg.topic(), msg.partition())
+            # Rewound history records sit below the committed offset already
+            if msg.offset() >= self.live_from.get(tp, 0):
+                self.fanned_out[tp] = msg.offset() + 1
+                self.uncommitted += 1
 
+    def request_commit(self, force: bool = False):
+        """Hand fanned-out offsets to the poll thread once enough records or time accrued."""
+        if not self.fanned_out:
+            return
+        now = time.monotonic()
+        if not force and self.uncommitted < WS_COMMIT_EVERY \
+                and now - self.last_commit < WS_COMMIT_INTERVAL:
+            return
+        with self.subscription_lock:
+            pending = self.pending_commit or {}
+            pending.update(self.fanned_out)
+            self.pending_commit = pending
+        self.fanned_out = {}
+        self.uncommitted = 0
+        self.last_commit = now
+
+    def _commit_pending(self, consumer: Consumer, asynchronous: bool = True):
+        """Commit the offsets handed over by the event loop (poll thread, or after it stopped)."""
+        with self.subscription_lock:
+            offsets, self.pending_commit = self.pending_commit, None
+        if not offsets:
+            return
+        try:
+            consumer.commit(offsets=[TopicPartition(t, p, o) for (t, p), o in offsets.items()],
+                            asynchronous=asynchronous)
+            WS_OFFSET_COMMITS.labels("async" if asynchronous else "sync").inc()
+        except Exception as e:
+            # The next commit carries newer offsets for the same partitions
+            logger.warning(f"WS consumer offset commit failed: {e}")
+
+    def on_commit(self, err, partitions):
+        """librdkafka callback for asynchronous commits (runs in the poll thread)."""
+        if err is not None:
+            logger.warning(f"WS consumer offset commit failed: {err}")
+
+    def _on_revoke(self, consumer: Consumer, partitions):
+        # Last chance to commit the revoked partitions as this member
+        self._commit_pending(consumer, asynchronous=False)
+        # An eager rebalance hands most of them straight back: remember where reading stopped
+        try:
+            self.resume_at = {(tp.topic, tp.partition): tp.offset
+                              for tp in consumer.position(partitions) if tp.offset >= 0}
+        except Exception as e:
+            logger.warning(f"WS consumer positions not saved on revoke: {e}")
+            self.resume_at = {}
+
+    async def commit_final(self):
+        """Synchronously commit everything fanned out; the poll thread must be stopped."""
+        if WS_COMMIT_MODE != "manual" or not self.consumer:
+            return
+        self.request_commit(force=True)
+        await asyncio.to_thread(self._commit_pending, self.consumer, False)
+
+    def _poll_loop(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        """Poll thread: consume() batches and pass them to the event loop."""
+        consumer = self.consumer
+        while not self.stop_polling.is_set():
+            with self.subscription_lock:
+                topics, self.pending_subscription = self.pending_subscription, None
+            # _on_assign reads committed offsets: they must be in before resubscribing
+            self._commit_pending(consumer, asynchronous=topics is None)
+            if topics is not None:
+                try:
+                    consumer.subscribe(sorted(topics), on_assign=self._on_assign,
+                                       on_revoke=self._on_revoke)
+                except Exception as e:
+                    logger.error(f"WS consumer subscribe failed: {e}")
+            # Backpressure: stop reading while the event loop is behind
+            if not self.batch_slots.acquire(timeout=WS_POLL_TIMEOUT):
+                continue
             try:
-                payload = json.loads(msg.value().decode('utf-8'))
-            except json.JSONDecodeError:
+                msgs = consumer.consume(WS_CONSUME_BATCH_SIZE, WS_POLL_TIMEOUT)
+            except Exception as e:
+                self.batch_slots.release()
+                logger.error(f"WS consumer poll failed: {e}")
+                self.stop_polling.wait(1.0)
                 continue
+            if msgs:
+                loop.call_soon_threadsafe(queue.put_nowait,
+                                          (msgs, time.time(), time.perf_counter()))
+            else:
+                self.batch_slots.release()
 
-            if payload.get("type") == "chat_message":
-                payload["active_connections"] = len(self.active_connections)
-                text = json.dumps(payload)
-                await self.broadcast(text)
-                logger.info(
-                    f"📡 Broadcasted: {payload.get('username')}: {payload.get('text')} "
-                    f"({len(self.active_connections)} conns)"
-                )
+    async def _dispatch(self, queue: asyncio.Queue):
+        """Deliver polled batches; between them, apply room changes such as expired lingers."""
+        while True:
+            try:
+                async with asyncio.timeout(1.0):
+                    msgs, polled_wall, polled_perf = await queue.get()
+                self.polled_at = (polled_wall, polled_perf)
+            except TimeoutError:
+                self.update_subscription()
+                self.request_commit()
+                continue
+            try:
+                for msg in msgs:
+                    try:
+                        self._handle_record(msg)
+                    except Exception:
+                        # One bad record must not stop delivery for every room
+                        logger.exception(f"WS record skipped ({msg.topic()} "
+                                         f"[{msg.partition()}] @ {msg.offset()})")
+            finally:
+                self.batch_slots.release()
+            if self.backfilling:
+                self._track_backfill(msgs)
+            self.track_offsets(msgs)
+            self.request_commit()
+            self.update_subscription()
+            # Let the writer tasks drain client queues before the next batch
+            await asyncio.sleep(0)
+
+    def _handle_record(self, msg):
+        """Add a chat message to its room's history and deliver it to the room."""
+        if msg.error():
+            # A room nobody has written to yet has no topic
+            if msg.error().code() not in (KafkaError._PARTITION_EOF,
+                                          KafkaError.UNKNOWN_TOPIC_OR_PART):
+                logger.error(f"Kafka error: {msg.error()}")
+            return
+
+        room = msg.topic()
+        if room not in self.subscribed:
+            return
+        meta = parse_headers(msg.headers())
+        streamed = room in stream_hub.recent
+        if meta is not None and meta.type != CHAT_MESSAGE and not streamed:
+            # Typed by its headers: nothing here needs the value
+            return
+        # Records rewound to fill history were already delivered live
+        live = msg.offset() >= self.live_from.get((room, msg.partition()), 0)
+        trace = None
+        if live and meta is not None and meta.type == CHAT_MESSAGE and meta.produced_at_ms \
+                and room in self.rooms and tracer.sampled(meta.trace_id):
+            polled_wall, polled_perf = self.polled_at
+            decode_started = time.perf_counter()
+            trace = tracer.start(room, meta.produced_at_ms, polled_wall,
+                                 decode_started - polled_perf)
+        try:
+            payload = record_codec(meta, value_codec).decode(msg.value())
+        except Exception:
+            return
+        if trace:
+            tracer.observe(room, "decode", time.perf_counter() - decode_started)
+        if streamed:
+            stream_hub.publish(msg, payload, live)
+
+        if (meta.type if meta is not None else payload_type(payload)) == CHAT_MESSAGE:
+            key = msg.key()
+            added = room_history(room).append(HistoryEntry(
+                payload.get("message_id"), msg.partition(), msg.offset(),
+                {
+                    "topic": room,
+                    "partition": msg.partition(),
+                    "offset": msg.offset(),
+                    "key": key.decode() if key else None,
+                    "value": payload,
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+            ))
+            # A record read again after a resubscribe was already delivered
+            if live and added:
+                self.deliver(room, payload, trace)
+
+    def _on_assign(self, consumer: Consumer, partitions):
+        """
+        Rewind newly assigned partitions far enough to refill chat history.
+
+        Runs in the poll thread. Records before the committed offset only go
+        to history; live delivery resumes at the committed offset (or at the
+        end when the group has none, rather than replaying the whole topic).
+        Rooms this process closed and reopened go live at the end too: their
+        committed offset dates from the last time the room was open.
+        Partitions that were already being read continue where the revoke
+        left them, so a room join does not re-read every other room.
+        """
+        resume_at, self.resume_at = self.resume_at, {}
+        # Backfilled partitions and where their rewound records end, for wait_backfill
+        backfill_ends: Dict[Tuple[str, int], int] = {}
+        try:
+            committed = consumer.committed(partitions, timeout=METADATA_TIMEOUT)
+            for tp, c in zip(partitions, committed):
+                key = (tp.topic, tp.partition)
+                if key in self.live_from:
+                    # Already being read: carry on from the revoke, else from what was fanned out
+                    tp.offset = resume_at.get(key, c.offset if c.offset >= 0
+                                              else self.live_from[key])
+                    continue
+                low, high = consumer.get_watermark_offsets(tp, timeout=METADATA_TIMEOUT)
+                live = c.offset if c.offset >= 0 and tp.topic not in self.fresh_topics else high
+                self.live_from[key] = live
+                backfill = CHAT_HISTORY_SIZE
+                if tp.topic in stream_hub.recent:
+                    backfill = max(backfill, STREAM_REPLAY_SIZE)
+                tp.offset = max(low, min(live, high - max(backfill, 0)))
+                if tp.offset < high:
+                    backfill_ends[key] = high
+        except Exception as e:
+            logger.error(f"Chat history backfill skipped: {e}")
+            return
+        finally:
+            self.fresh_topics.difference_update(tp.topic for tp in partitions)
+        consumer.assign(partitions)
+        self.loop.call_soon_threadsafe(self._backfill_assigned,
+                                       {tp.topic for tp in partitions}, backfill_ends)
 
     def set_consumer(self, consumer: Consumer):
         self.consumer = consumer
@@ -215,18 +1890,64 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 # ─── Startup / Shutdown ──────────────────────────────────────────────────────
-@app.on_event("startup")
-async def on_startup():
-    # set up the background consumer
-    manager.set_consumer(create_consumer("ws-chat-group"))
-    asyncio.create_task(manager.start_kafka_consumption())
+# Kafka start-up runs in the background after the server starts listening; /ready tracks it
+warmup = KafkaWarmup("consumer")
+warmup.checks.append(manager.consumption_error)
+
+@warmup.step("clients")
+async def start_clients():
+    # Constructing consumers only spawns librdkafka threads; connecting happens there
+    if metadata_cache.client is None:
+        metadata_cache.start(health_consumer.get())
+    if manager.consumer is None:
+        commit_config = {}
+        if WS_COMMIT_MODE == "manual":
+            commit_config = {'enable.auto.commit': False, 'on_commit': manager.on_commit}
+        manager.set_consumer(create_consumer(manager.group_id, **metadata_cache.client_config(),
+                                             **commit_config))
+    manager.start_kafka_consumption()
     logger.info("✅ Background Kafka WS consumer started")
 
-@app.on_event("shutdown")
+@warmup.step("metadata")
+async def fetch_metadata():
+    await wait_metadata(metadata_cache)
+
+@warmup.step("group-coordinator")
+async def find_group_coordinator():
+    # An offset fetch makes the WS consumer locate its group coordinator now,
+    # so the join for the first chat room does not pay for the lookup
+    await asyncio.to_thread(manager.consumer.committed, [TopicPartition(DEFAULT_ROOM, 0)],
+                            timeout=WARMUP_TIMEOUT)
+
+async def on_startup():
+    """Local setup only; Kafka clients come up in the warm-up task."""
+    if WS_WORKERS > 1:
+        manager.presence = PresenceBoard()
+        slot = manager.presence.claim_slot()
+        # Each worker must see every message: one group per worker slot. Slots
+        # are reused after restarts, so committed offsets are too.
+        manager.group_id = f"{WS_CONSUMER_GROUP}-{WS_INSTANCE_ID}-{slot}"
+        manager.presence_task = asyncio.create_task(manager.run_presence())
+        logger.info(f"WebSocket worker {slot} of {WS_WORKERS} (group {manager.group_id})")
+    consumer_pool.start()
+    warmup.start()
+
 async def on_shutdown():
-    health_consumer.close()
+    await warmup.stop()
+    # Joining threads and closing consumers block; keep the loop serving meanwhile
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, metadata_cache.stop)
+    await consumer_pool.close()
+    await loop.run_in_executor(None, health_consumer.close)
+    # The poll thread must be out of consume() before the consumer is closed
+    await manager.stop_kafka_consumption()
+    await manager.commit_final()
     if manager.consumer:
-        manager.consumer.close()
+        await loop.run_in_executor(None, manager.consumer.close)
+    if manager.presence_task:
+        manager.presence_task.cancel()
+    if manager.presence:
+        manager.presence.close()
     logger.info("🔚 Kafka consumers closed")
 
 # ─── HTTP endpoints ───────────────────────────────────────────────────────────
@@ -241,11 +1962,17 @@ async def api_info():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "ready": "/ready",
             "consume": "/consume",
             "topics": "/topics",
             "messages": "/messages/{topic}",
             "chat": "/chat/messages",
+            "rooms": "/chat/rooms",
+            "latency": "/chat/latency",
+            "stream": "/stream/{topic}",
             "ws": "/ws/chat",
+            "consumer_pool": "/consumer/pool",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -253,38 +1980,70 @@ async def api_info():
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     ok = check_kafka_connection()
+    ws_error = manager.consumption_error()
     return HealthResponse(
-        status="healthy" if ok else "unhealthy",
+        status="healthy" if ok and ws_error is None else "unhealthy",
         timestamp=datetime.utcnow().isoformat(),
-        kafka_connected=ok
+        kafka_connected=ok,
+        metadata_age_seconds=metadata_cache.age,
+        last_metadata_refresh=metadata_cache.last_refresh_iso(),
+        ws_consumer_error=ws_error
     )
 
+@app.get("/ready")
+async def readiness():
+    """200 once the Kafka clients are warmed up, 503 until then (for load balancers and probes)."""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/consumer/pool")
+async def consumer_pool_stats():
+    return consumer_pool.stats()
+
+@app.get("/chat/rooms")
+async def chat_rooms():
+    """Connected WebSocket clients per room, and the rooms this worker's WS consumer reads."""
+    counts = manager.room_counts()
+    return {
+        "rooms": counts,
+        "active_connections": sum(counts.values()),
+        "worker_connections": len(manager.active_connections),
+        "subscribed": sorted(manager.subscribed),
+    }
+
+@app.get("/chat/latency")
+async def chat_latency(room: Optional[str] = None):
+    """Sampled delivery stage latencies per room on this worker (all traced rooms by default)."""
+    rooms = [room] if room else sorted(tracer.rooms)
+    return {
+        "sample_rate": WS_TRACE_SAMPLE_RATE,
+        "stages": list(TRACE_STAGES),
+        "rooms": {name: tracer.summary(name) for name in rooms},
+    }
+
 @app.post("/consume", response_model=ConsumeResponse)
 async def consume_messages(req: ConsumeRequest):
-    consumer = create_consumer(req.group_id)
-    consumer.subscribe([req.topic])
-
-    msgs: List[MessageInfo] = []
-    for _ in range(req.max_messages):
-        msg = consumer.poll(req.timeout)
-        if msg is None or msg.error():
-            if msg and msg.error().code() != KafkaError._PARTITION_EOF:
-                raise HTTPException(500, f"Kafka error: {msg.error()}")
-            break
-        try:
-            data = json.loads(msg.value().decode())
-            msgs.append(MessageInfo(
-                topic=msg.topic(),
-                partition=msg.partition(),
-                offset=msg.offset(),
-                key=msg.key().decode() if msg.key() else None,
-                value=data,
-                timestamp=datetime.utcnow().isoformat()
-            ))
-        except Exception:
-            continue
+    try:
+        codec = get_codec(req.codec) if req.codec else None
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    max_bytes = min(req.max_bytes or CONSUME_MAX_BYTES, CONSUME_MAX_BYTES)
+    try:
+        msgs, error = await consumer_pool.run(
+            req.group_id, [req.topic], read_batch,
+            req.max_messages, read_timeout(req.timeout), max_bytes, codec, req.message_type
+        )
+    except ConsumerPoolExhausted as e:
+        raise pool_exhausted_error(e)
+    # Messages read before an error are returned (their offsets are consumed)
+    if error and not msgs:
+        raise HTTPException(500, f"Kafka error: {error}")
 
-    consumer.close()
     return ConsumeResponse(
         success=True,
         messages=msgs,
@@ -295,53 +2054,186 @@ async def consume_messages(req: ConsumeRequest):
 
 @app.get("/topics", response_model=List[TopicInfo])
 async def list_topics():
-    try:
-        md = health_consumer.list_topics(timeout=5)
-        out = []
-        for name, meta in md.topics.items():
-            if name.startswith("__"):
-                continue
-            out.append(TopicInfo(topic=name, partitions=len(meta.partitions), group_id="—"))
-        return out
-    except Exception as e:
-        raise HTTPException(500, f"Failed to list topics: {e}")
+    if metadata_cache.last_refresh is None:
+        raise HTTPException(503, f"Topic metadata not available yet: {metadata_cache.last_error}")
+    return [
+        TopicInfo(topic=name, partitions=partitions, group_id="—")
+        for name, partitions in metadata_cache.topics.items()
+        if not name.startswith("__")
+    ]
 
 @app.post("/chat/messages")
 async def get_chat_messages(req: ChatMessageRequest):
-    consumer = create_consumer(req.group_id)
-    consumer.subscribe([req.topic])
-    out: List[MessageInfo] = []
+    history = chat_history.get(req.topic)
+    if history is not None:
+        limit = min(max(req.limit, 0), CHAT_HISTORY_SIZE)
+        if req.last_message_id:
+            entries, has_more, gap = history.since(req.last_message_id, limit)
+        else:
+            entries, has_more, gap = history.tail(limit), False, False
+        return {
+            "success": True,
+            "messages": [e.info for e in entries],
+            "count": len(entries),
+            "topic": req.topic,
+            "has_more": has_more,
+            "gap": gap
+        }
 
-    for _ in range(50):
-        msg = consumer.poll(1.0)
-        if msg is None or msg.error():
-            break
-        try:
-            payload = json.loads(msg.value().decode())
-            if payload.get("type") == "chat_message":
-                out.append(MessageInfo(
-                    topic=msg.topic(),
-                    partition=msg.partition(),
-                    offset=msg.offset(),
-                    key=msg.key().decode() if msg.key() else None,
-                    value=payload,
-                    timestamp=datetime.utcnow().isoformat()
-                ))
-        except Exception:
-            continue
+    # Rooms the WebSocket consumer does not follow are read through the pool
+    try:
+        out, _ = await consumer_pool.run(
+            req.group_id, [req.topic], read_batch,
+            req.limit, 1.0, CONSUME_MAX_BYTES, None, CHAT_MESSAGE
+        )
+    except ConsumerPoolExhausted as e:
+        raise pool_exhausted_error(e)
 
-    consumer.close()
     return {"success": True, "messages": out, "count": len(out), "topic": req.topic}
 
+@app.get("/messages/{topic}")
+async def get_messages(topic: str, limit: int = 10, partition: Optional[int] = None,
+                       offset: Optional[int] = None, timestamp: Optional[str] = None,
+                       cursor: Optional[str] = None, timeout: float = 5.0,
+                       codec: Optional[str] = None):
+    try:
+        value_decoder = get_codec(codec) if codec else None
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    limit = min(max(limit, 1), REPLAY_MAX_LIMIT)
+
+    position = ReplayPosition()
+    if cursor:
+        position.cursor = parse_cursor(cursor)
+    elif timestamp:
+        try:
+            position.timestamp_ms = int(timestamp)
+        except ValueError:
+            try:
+                position.timestamp_ms = int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+            except ValueError:
+                raise HTTPException(400, "timestamp must be epoch milliseconds or ISO 8601")
+    else:
+        position.offset = offset
+
+    if position.cursor is not None:
+        partitions = sorted(position.cursor)
+    elif partition is not None:
+        partitions = [partition]
+    else:
+        partitions = None
+    # Topics the cache does not know yet are resolved against the broker by read_range
+    count = metadata_cache.topics.get(topic)
+    if count and partitions and any(p < 0 or p >= count for p in partitions):
+        raise HTTPException(400, f"Topic '{topic}' has {count} partition(s)")
+
+    try:
+        page = await consumer_pool.run(
+            REPLAY_GROUP, [], read_range,
+            topic, partitions, count or None, position, limit, read_timeout(timeout), value_decoder
+        )
+    except ConsumerPoolExhausted as e:
+        raise pool_exhausted_error(e)
+    except LookupError:
+        raise HTTPException(404, f"Topic '{topic}' not found")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except KafkaException as e:
+        raise HTTPException(500, f"Kafka error: {e}")
+    if page["error"] and not page["messages"]:
+        raise HTTPException(500, f"Kafka error: {page['error']}")
+
+    return {
+        "success": True,
+        "messages": page["messages"],
+        "count": len(page["messages"]),
+        "topic": topic,
+        "next_cursor": page["next_cursor"],
+        "end_of_topic": page["end_of_topic"],
+    }
+
+@app.get("/stream/{topic}")
+async def stream_topic(topic: str, format: str = "sse", history: int = 0,
+                       last_event_id: Optional[str] = None,
+                       last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """
+    Stream new records of topic as Server-Sent Events or NDJSON.
+
+    Event ids are partition:offset. Reconnecting with Last-Event-ID (or
+    ?last_event_id=) resumes after that record while it is still buffered;
+    ?history=N starts with the last N records.
+    """
+    if format not in STREAM_FORMATS:
+        raise HTTPException(400, f"format must be one of {', '.join(STREAM_FORMATS)}")
+    if not ROOM_NAME.match(topic):
+        raise HTTPException(400, "Invalid topic name")
+    if topic not in manager.subscribed and len(manager.subscribed) >= WS_MAX_ROOMS:
+        raise HTTPException(503, f"Already following {WS_MAX_ROOMS} topics")
+
+    # Validated before anything is buffered or subscribed for the topic
+    after = StreamHub.parse_event_id(last_event_id_header or last_event_id)
+    history = min(max(history, 0), STREAM_REPLAY_SIZE)
+    if history or after is not None:
+        # Buffer before subscribing so the backfill fills it, and replay once it has
+        stream_hub.buffer(topic)
+        await manager.wait_backfill(topic)
+    stream, replay, gap = stream_hub.open(topic, format, after, history)
+    manager.update_subscription()
+    sse = format == "sse"
+    keepalive = b": keepalive\n\n" if sse else b'{"type":"heartbeat"}\n'
+
+    async def events():
+        try:
+            if sse:
+                yield b"retry: 2000\n\n"
+            if gap:
+                yield b"event: gap\ndata: {}\n\n" if sse else b'{"type":"gap"}\n'
+            if replay:
+                yield b"".join(event.encode(format) for event in replay)
+            while True:
+                if stream.queue:
+                    chunks = list(stream.queue)
+                    stream.queue.clear()
+                    yield b"".join(chunks)
+                    continue
+                if stream.overflowed:
+                    # Reconnect with Last-Event-ID to continue from the replay buffer
+                    yield b"event: overflow\ndata: {}\n\n" if sse else b'{"type":"overflow"}\n'
+                    return
+                stream.wakeup.clear()
+                try:
+                    async with asyncio.timeout(HEARTBEAT_INTERVAL):
+                        await stream.wakeup.wait()
+                except TimeoutError:
+                    yield keepalive
+        finally:
+            stream_hub.close(stream)
+            manager.release_topic(topic)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ─── WebSocket endpoint ───────────────────────────────────────────────────────
 @app.websocket("/ws/chat")
-async def ws_chat(websocket: WebSocket):
-    await manager.connect(websocket)
+async def ws_chat(websocket: WebSocket, room: str = DEFAULT_ROOM,
+                  since: Optional[str] = None, history: int = 0, batch: bool = False):
+    """
+    Join ?room=<topic>. ?since=<message_id> replays what a reconnecting
+    client missed; ?history=N sends the last N. ?batch=1 asks for chat
+    messages in chat_batch array frames. The chat.msgpack subprotocol
+    switches frames to binary MessagePack.
+    """
+    if not await manager.connect(websocket, room=room, since=since, history=history,
+                                 batched=batch):
+        return
     try:
-        # Block here until client disconnects; receive_text() will raise on close
+        # Block here until client disconnects; inbound frames (text or binary) are ignored
         while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
+            if (await websocket.receive())["type"] == "websocket.disconnect":
+                break
+    except RuntimeError:
+        # The server closed the socket (slow client evicted)
         pass
     finally:
         await manager.disconnect(websocket)
@@ -353,5 +2245,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8002,
         reload=False,   # turn off in prod
+        workers=WS_WORKERS,
+        ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
         log_level="info"
     )
@@ -4,19 +4,32 @@ Kafka Producer API Server
 FastAPI server that provides HTTP endpoints for producing messages to Kafka.
 """
 
-import json
+import asyncio
+import contextlib
 import os
+import socket
+import threading
 import time
+import zlib
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from confluent_kafka import Producer
+from confluent_kafka import KafkaException, Producer
 import uvicorn
 
+from common.codecs import JSON, codec_for_content_type, default_codec
+from common.headers import Headers, build_headers, payload_type
+from common.kafka_clients import WARMUP_TIMEOUT, KafkaWarmup, producer_config, wait_metadata
+from common.metadata import MetadataCache
+from common.metrics import (
+    CONTENT_TYPE_LATEST, KafkaStatsCollector, MetricsRegistry, RequestMetricsMiddleware
+)
+
 
 # Pydantic models for request/response
 class MessageRequest(BaseModel):
@@ -45,52 +58,686 @@ class HealthResponse(BaseModel):
     status: str
     timestamp: str
     kafka_connected: bool
+    metadata_age_seconds: Optional[float] = None
+    last_metadata_refresh: Optional[str] = None
+
+
+class QueueStatsResponse(BaseModel):
+    in_flight_messages: int
+    in_flight_bytes: int
+    max_in_flight_messages: int
+    max_in_flight_bytes: int
+    librdkafka_queue_length: int
+    waiting_requests: int
+    rejected_in_flight_limit: int
+    rejected_buffer_full: int
+
+
+# Cluster metadata refreshed in the background for /health
+metadata_cache = MetadataCache("producer")
+
+# How often the delivery thread serves librdkafka callbacks (seconds)
+DELIVERY_POLL_INTERVAL = float(os.getenv('PRODUCER_POLL_INTERVAL', '0.1'))
 
+# In-flight limits: messages produced but not yet acknowledged by the broker
+MAX_IN_FLIGHT_MESSAGES = int(os.getenv('PRODUCER_MAX_IN_FLIGHT_MESSAGES', '10000'))
+MAX_IN_FLIGHT_BYTES = int(os.getenv('PRODUCER_MAX_IN_FLIGHT_BYTES', str(32 * 1024 * 1024)))
+# Upper bound for the per-request queue_wait_ms parameter
+MAX_QUEUE_WAIT_MS = int(os.getenv('PRODUCER_MAX_QUEUE_WAIT_MS', '5000'))
+RETRY_AFTER_SECONDS = int(os.getenv('PRODUCER_RETRY_AFTER_SECONDS', '1'))
 
-# Global producer instance
-producer: Optional[Producer] = None
+# Streaming ingest: longest accepted NDJSON line and number of errors echoed back
+STREAM_MAX_LINE_BYTES = int(os.getenv('PRODUCER_STREAM_MAX_LINE_BYTES', str(1024 * 1024)))
+STREAM_MAX_REPORTED_ERRORS = int(os.getenv('PRODUCER_STREAM_MAX_REPORTED_ERRORS', '10'))
+
+# Idempotency-Key replay cache: entries kept and how long a key is remembered
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('PRODUCER_IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('PRODUCER_IDEMPOTENCY_TTL_SECONDS', '300'))
+
+# Worker ID (0-1023) embedded in message IDs; must differ between producer processes.
+# The default hashes hostname and pid: containers all run as pid 1 or another small pid
+WORKER_ID = int(os.getenv('PRODUCER_WORKER_ID') or
+                zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode()) & 0x3FF)
+
+# Codec for message values written to Kafka (MESSAGE_CODEC: json, orjson, msgpack)
+value_codec = default_codec()
+if value_codec.name == "raw":
+    # Every endpoint but /produce/raw encodes a JSON object, which raw cannot
+    raise ValueError("MESSAGE_CODEC=raw cannot encode messages (use /produce/raw for raw bodies)")
+
+# Prometheus metrics served at /metrics
+metrics = MetricsRegistry()
+REQUEST_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by endpoint",
+    ("method", "route", "status")
+)
+PRODUCE_ACK_LATENCY = metrics.histogram(
+    "producer_ack_latency_seconds", "Time from produce() to broker acknowledgement",
+    ("profile",)
+)
+DELIVERY_FAILURES = metrics.counter(
+    "producer_delivery_failures_total", "Messages whose delivery report was an error",
+    ("profile",)
+)
+metrics.callback_gauge("producer_in_flight_messages", "Messages awaiting a delivery report",
+                       lambda: in_flight.messages)
+metrics.callback_gauge("producer_in_flight_bytes", "Bytes awaiting a delivery report",
+                       lambda: in_flight.bytes)
+metrics.callback_gauge("producer_queue_waiting_requests", "Requests waiting for in-flight capacity",
+                       lambda: in_flight.waiting)
+metrics.callback_counter("producer_rejected_total", "Messages rejected by backpressure",
+                         lambda: [(("in_flight_limit",), in_flight.rejected),
+                                  (("buffer_full",), in_flight.buffer_full)],
+                         ("reason",))
+metrics.callback_counter("producer_idempotent_replays_total",
+                         "Requests answered from the Idempotency-Key cache",
+                         lambda: idempotency_cache.replays)
+kafka_stats = KafkaStatsCollector(metrics)
+metadata_cache.stats_listeners.append(kafka_stats.on_stats)
 
 
 def delivery_report(err, msg):
     """Delivery report callback for produced messages."""
     if err is not None:
         print(f'❌ Message delivery failed: {err}')
+
+
+class DeliveryPoller:
+    """
+    Serves producer delivery callbacks from a dedicated thread.
+
+    Handlers never flush: they produce and await a future that the poll thread
+    resolves once the broker acks, so concurrent requests share broker batches.
+    """
+
+    def __init__(self, kafka_producer: Producer):
+        self.producer = kafka_producer
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="producer-poll", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.producer.poll(DELIVERY_POLL_INTERVAL)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+class BackpressureError(Exception):
+    """Raised when a message cannot be admitted to the producer queue."""
+
+    def __init__(self, detail: str, status_code: int = 429):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+class InFlightLimiter:
+    """
+    Caps messages and bytes awaiting a delivery report.
+
+    All accounting happens on the event loop thread (delivery futures are
+    resolved there), so no lock is needed.
+    """
+
+    def __init__(self, max_messages: int, max_bytes: int):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.messages = 0
+        self.bytes = 0
+        self.rejected = 0
+        self.buffer_full = 0
+        self._waiters: deque = deque()
+
+    def try_acquire(self, size: int) -> bool:
+        # A single oversized message is admitted when nothing else is in flight
+        if self.messages and (self.messages >= self.max_messages
+                              or self.bytes + size > self.max_bytes):
+            return False
+        self.messages += 1
+        self.bytes += size
+        return True
+
+    async def acquire(self, size: int, max_wait: float = 0.0):
+        """Reserve room for one message, waiting up to max_wait seconds."""
+        if self.try_acquire(size):
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.rejected += 1
+                raise BackpressureError(
+                    f"Producer in-flight limit reached "
+                    f"({self.messages} messages, {self.bytes} bytes)"
+                )
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if not waiter.done():
+                    waiter.cancel()
+            if self.try_acquire(size):
+                return
+
+    def release(self, size: int):
+        self.messages -= 1
+        self.bytes -= size
+        # Wake every waiter: the first may still not fit while smaller ones would
+        waiters, self._waiters = self._waiters, deque()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+
+in_flight = InFlightLimiter(MAX_IN_FLIGHT_MESSAGES, MAX_IN_FLIGHT_BYTES)
+
+
+def _resolve_delivery(future: asyncio.Future, size: int, profile: str, started: float, err, msg):
+    """Complete a produce future on the event loop thread."""
+    in_flight.release(size)
+    if err is not None:
+        DELIVERY_FAILURES.labels(profile).inc()
+    else:
+        PRODUCE_ACK_LATENCY.labels(profile).observe(time.perf_counter() - started)
+    if future.done():
+        return
+    if err is not None:
+        future.set_exception(KafkaException(err))
     else:
-        print(f'✅ Message delivered to {msg.topic()} [{msg.partition()}] at offset {msg.offset()}')
+        future.set_result(msg)
 
 
-def create_producer():
-    """Create and return a Kafka producer."""
-    bootstrap_servers = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
-    
-    config = {
-        'bootstrap.servers': bootstrap_servers,
-        'client.id': 'python-producer-api',
+async def enqueue_message(topic: str, value: bytes, key: Optional[bytes] = None,
+                          partition: Optional[int] = None,
+                          max_wait: float = 0.0,
+                          profile: Optional[str] = None,
+                          headers: Optional[Headers] = None) -> asyncio.Future:
+    """
+    Admit a message to the producer queue and return its delivery future.
+
+    Waits up to max_wait seconds for in-flight capacity and raises
+    BackpressureError if none frees up. The message goes to the producer for
+    the topic's profile (falling back to the endpoint's profile). The returned
+    future is resolved with the delivered Message by the poll thread.
+    """
+    profile = producers.resolve_profile(topic, profile)
+    kafka_producer = producers.get(profile)
+    size = len(value) + (len(key) if key else 0)
+    await in_flight.acquire(size, max_wait)
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    started = time.perf_counter()
+
+    def on_delivery(err, msg):
+        delivery_report(err, msg)
+        loop.call_soon_threadsafe(_resolve_delivery, future, size, profile, started, err, msg)
+
+    kwargs = {}
+    if partition is not None:
+        kwargs['partition'] = partition
+    if headers:
+        kwargs['headers'] = headers
+    try:
+        kafka_producer.produce(topic=topic, key=key, value=value, on_delivery=on_delivery, **kwargs)
+    except BufferError:
+        in_flight.release(size)
+        in_flight.buffer_full += 1
+        raise BackpressureError("Producer queue is full", status_code=503)
+    except BaseException:
+        in_flight.release(size)
+        raise
+    return future
+
+
+async def produce_async(topic: str, value: bytes, key: Optional[bytes] = None,
+                        partition: Optional[int] = None, max_wait: float = 0.0,
+                        profile: Optional[str] = None, headers: Optional[Headers] = None):
+    """Produce a message and wait for its broker acknowledgement."""
+    future = await enqueue_message(topic, value, key, partition, max_wait, profile, headers)
+    return await future
+
+
+def queue_wait_seconds(queue_wait_ms: int) -> float:
+    """Clamp a client-requested queue wait to the configured maximum."""
+    return min(max(queue_wait_ms, 0), MAX_QUEUE_WAIT_MS) / 1000.0
+
+
+def backpressure_error(e: BackpressureError) -> HTTPException:
+    """Translate a rejected admission into a fast 429/503 with a retry hint."""
+    return HTTPException(
+        status_code=e.status_code,
+        detail=str(e),
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+
+def stamp_message(message: Dict[str, Any], source: str = "python-producer-api") -> Dict[str, Any]:
+    """Add server metadata to a request-owned message dict in place."""
+    message["timestamp"] = datetime.now().isoformat()
+    message["source"] = source
+    message["server_time"] = time.time()
+    return message
+
+
+def message_headers(message: Dict[str, Any]) -> Headers:
+    """Record headers for a stamped message encoded with value_codec."""
+    return build_headers(payload_type(message), value_codec.content_type,
+                         message.get("server_time"))
+
+
+class IdempotencyCache:
+    """
+    Bounded LRU+TTL map from (endpoint, Idempotency-Key) to the first result.
+
+    A repeat of a key returns the original result instead of producing again;
+    a repeat that arrives while the first attempt is still in flight awaits
+    it. Failed attempts are forgotten so the client's retry runs again. Used
+    only from the event loop thread, so no lock is needed.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.replays = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, asyncio.Future]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def run(self, scope: str, key: Optional[str],
+                  fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, replayed), calling fn() only for a new key."""
+        if not key:
+            return await fn(), False
+
+        cache_key = (scope, key)
+        now = time.monotonic()
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            expires, future = entry
+            if expires > now:
+                self._entries.move_to_end(cache_key)
+                self.replays += 1
+                return await asyncio.shield(future), True
+            del self._entries[cache_key]
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[cache_key] = (now + self.ttl, future)
+        self._evict(now)
+        try:
+            result = await fn()
+        except BaseException as e:
+            if self._entries.get(cache_key, (None, None))[1] is future:
+                del self._entries[cache_key]
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't warn when there are none
+            raise
+        future.set_result(result)
+        return result, False
+
+    def _evict(self, now: float):
+        while self._entries:
+            oldest_key, (expires, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and expires > now:
+                break
+            del self._entries[oldest_key]
+
+
+class SnowflakeIds:
+    """
+    64-bit time-ordered IDs: 41 bits of milliseconds since ID_EPOCH_MS,
+    10 bits of worker ID and a 12-bit per-millisecond sequence.
+
+    IDs are issued on the event loop thread only, so the sequence needs no
+    lock. A clock that steps back keeps the last timestamp and a full
+    sequence borrows the next millisecond, so IDs never repeat and always
+    increase within a worker.
+    """
+
+    ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    SEQUENCE_BITS = 12
+    WORKER_BITS = 10
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id < (1 << self.WORKER_BITS):
+            raise ValueError(f"worker_id must be in [0, {1 << self.WORKER_BITS})")
+        self.worker_bits = worker_id << self.SEQUENCE_BITS
+        self.last_ms = 0
+        self.sequence = 0
+
+    def next_id(self) -> int:
+        now_ms = int(time.time() * 1000) - self.ID_EPOCH_MS
+        if now_ms > self.last_ms:
+            self.last_ms = now_ms
+            self.sequence = 0
+        else:
+            self.sequence += 1
+            if self.sequence >> self.SEQUENCE_BITS:
+                self.last_ms += 1
+                self.sequence = 0
+        return (self.last_ms << (self.WORKER_BITS + self.SEQUENCE_BITS)) | self.worker_bits | self.sequence
+
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS)
+message_ids = SnowflakeIds(WORKER_ID)
+
+
+async def idempotent(response: Response, scope: str, key: Optional[str],
+                     fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Run a produce handler once per Idempotency-Key, marking replayed responses."""
+    result, replayed = await idempotency_cache.run(scope, key, fn)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+# Named tuning profiles; each profile gets its own Producer instance
+PRODUCER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {
         'acks': 'all',
         'retries': 3,
         'batch.size': 16384,
         'linger.ms': 1,
-    }
-    return Producer(config)
+    },
+    # Chat: send immediately, wait for the leader only
+    "low-latency": {
+        'acks': '1',
+        'retries': 3,
+        'batch.size': 16384,
+        'linger.ms': 0,
+        'compression.type': 'lz4',
+        'enable.idempotence': False,
+    },
+    # Bulk: large compressed batches, durable and duplicate-free
+    "high-throughput": {
+        'acks': 'all',
+        'retries': 10,
+        'batch.size': 1048576,
+        'linger.ms': 50,
+        'compression.type': 'zstd',
+        'enable.idempotence': True,
+    },
+}
+
+DEFAULT_PRODUCER_PROFILE = os.getenv('PRODUCER_DEFAULT_PROFILE', 'default')
+CHAT_PRODUCER_PROFILE = os.getenv('CHAT_PRODUCER_PROFILE', 'low-latency')
+BULK_PRODUCER_PROFILE = os.getenv('BULK_PRODUCER_PROFILE', 'high-throughput')
+
+
+def parse_topic_profiles(spec: str) -> Dict[str, str]:
+    """Parse PRODUCER_TOPIC_PROFILES, e.g. "orders=high-throughput,alerts=low-latency"."""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        topic, _, profile = item.partition('=')
+        if not topic or not profile:
+            raise ValueError(f"Invalid PRODUCER_TOPIC_PROFILES entry: '{item}'")
+        mapping[topic.strip()] = profile.strip()
+    return mapping
+
+
+# Topic overrides win over the endpoint's profile
+TOPIC_PROFILES = parse_topic_profiles(os.getenv('PRODUCER_TOPIC_PROFILES', ''))
+
+for _profile in {DEFAULT_PRODUCER_PROFILE, CHAT_PRODUCER_PROFILE,
+                 BULK_PRODUCER_PROFILE, *TOPIC_PROFILES.values()}:
+    if _profile not in PRODUCER_PROFILES:
+        raise ValueError(f"Unknown producer profile '{_profile}' "
+                         f"(available: {', '.join(PRODUCER_PROFILES)})")
+
+
+def create_producer(profile: str = DEFAULT_PRODUCER_PROFILE):
+    """Create and return a Kafka producer tuned with the given profile."""
+    return Producer(producer_config(f'python-producer-api-{profile}',
+                                    **PRODUCER_PROFILES[profile],
+                                    **metadata_cache.client_config()))
+
+
+class ProducerRegistry:
+    """
+    Lazily creates one producer, with its own delivery poll thread, per profile.
+
+    Topics and endpoints resolve to a profile, so chat and bulk traffic never
+    share batching or acknowledgement settings.
+    """
+
+    def __init__(self):
+        self.producers: Dict[str, Producer] = {}
+        self.pollers: Dict[str, DeliveryPoller] = {}
+
+    def get(self, profile: str) -> Producer:
+        kafka_producer = self.producers.get(profile)
+        if kafka_producer is None:
+            kafka_producer = create_producer(profile)
+            poller = DeliveryPoller(kafka_producer)
+            poller.start()
+            self.producers[profile] = kafka_producer
+            self.pollers[profile] = poller
+            print(f"✅ Producer initialized (profile: {profile})")
+        return kafka_producer
+
+    @staticmethod
+    def resolve_profile(topic: str, endpoint_profile: Optional[str] = None) -> str:
+        return TOPIC_PROFILES.get(topic) or endpoint_profile or DEFAULT_PRODUCER_PROFILE
+
+    def queue_length(self) -> int:
+        return sum(len(p) for p in self.producers.values())
+
+    def close(self):
+        for poller in self.pollers.values():
+            poller.stop()
+        for kafka_producer in self.producers.values():
+            kafka_producer.flush()
+        self.pollers.clear()
+        self.producers.clear()
+
+
+producers = ProducerRegistry()
 
 
 def check_kafka_connection():
-    """Check if Kafka is accessible."""
+    """Check if Kafka is accessible, from the background metadata cache."""
+    return metadata_cache.healthy
+
+
+class StreamIngestSummary:
+    """
+    Running totals for one NDJSON ingest request.
+
+    Delivery futures update the summary from done-callbacks and are then
+    dropped, so memory stays constant no matter how many records stream in.
+    """
+
+    def __init__(self):
+        self.lines = 0
+        self.accepted = 0
+        self.delivered = 0
+        self.failed = 0
+        self.errors = []
+        self.partitions: Dict[tuple, Dict[str, int]] = {}
+        self._pending = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    def error(self, line: int, detail: str):
+        self.failed += 1
+        if len(self.errors) < STREAM_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": detail})
+
+    def track(self, line: int, future: asyncio.Future):
+        self.accepted += 1
+        self._pending += 1
+        self._drained.clear()
+        future.add_done_callback(lambda f: self._on_delivery(line, f))
+
+    def _on_delivery(self, line: int, future: asyncio.Future):
+        self._pending -= 1
+        if not self._pending:
+            self._drained.set()
+        if future.cancelled():
+            self.error(line, "Delivery cancelled")
+            return
+        err = future.exception()
+        if err is not None:
+            self.error(line, f"Delivery failed: {err}")
+            return
+        msg = future.result()
+        self.delivered += 1
+        offset = msg.offset()
+        part = self.partitions.get((msg.topic(), msg.partition()))
+        if part is None:
+            self.partitions[(msg.topic(), msg.partition())] = {
+                "first_offset": offset, "last_offset": offset, "count": 1
+            }
+        else:
+            part["first_offset"] = min(part["first_offset"], offset)
+            part["last_offset"] = max(part["last_offset"], offset)
+            part["count"] += 1
+
+    async def wait_delivered(self):
+        await self._drained.wait()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "success": self.failed == 0,
+            "lines": self.lines,
+            "accepted": self.accepted,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "errors": self.errors,
+            "partitions": [
+                {"topic": topic, "partition": partition, **offsets}
+                for (topic, partition), offsets in sorted(self.partitions.items())
+            ]
+        }
+
+
+def parse_ndjson_record(line: bytes, default_topic: str) -> tuple:
+    """
+    Parse one NDJSON line shaped like MessageRequest without pydantic.
+
+    Returns (topic, key, message, partition); raises ValueError with a short
+    reason for malformed records.
+    """
+    record = JSON.decode(line)
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+    message = record.get("message")
+    if not isinstance(message, dict):
+        raise ValueError("'message' must be a JSON object")
+    topic = record.get("topic", default_topic)
+    key = record.get("key")
+    partition = record.get("partition")
+    if not isinstance(topic, str) or not topic:
+        raise ValueError("'topic' must be a non-empty string")
+    if key is not None and not isinstance(key, str):
+        raise ValueError("'key' must be a string")
+    if partition is not None and (not isinstance(partition, int) or isinstance(partition, bool)):
+        raise ValueError("'partition' must be an integer")
+    return topic, key, message, partition
+
+
+async def iter_ndjson_lines(request: Request):
+    """
+    Yield (line_number, line_bytes_or_None) from a streamed request body.
+
+    Lines longer than STREAM_MAX_LINE_BYTES are yielded as None and skipped
+    without being buffered, so memory is bounded by the line limit.
+    """
+    buffer = bytearray()
+    line_no = 0
+    oversized = False
+    async for chunk in request.stream():
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not oversized:
+                    buffer += chunk[start:]
+                    if len(buffer) > STREAM_MAX_LINE_BYTES:
+                        oversized = True
+                        buffer.clear()
+                break
+            line_no += 1
+            if oversized:
+                yield line_no, None
+                oversized = False
+            else:
+                buffer += chunk[start:end]
+                if len(buffer) > STREAM_MAX_LINE_BYTES:
+                    yield line_no, None
+                elif buffer.strip():
+                    yield line_no, bytes(buffer)
+            buffer.clear()
+            start = end + 1
+    if oversized:
+        yield line_no + 1, None
+    elif buffer.strip():
+        yield line_no + 1, bytes(buffer)
+
+
+# Kafka start-up runs in the background after the server starts listening; /ready tracks it
+warmup = KafkaWarmup("producer")
+
+
+@warmup.step("producers")
+async def build_producers():
+    # Constructing a producer only spawns librdkafka threads; connecting happens there.
+    # On the event loop, like request handlers, since the registry is not thread-safe.
+    if metadata_cache.client is None:
+        metadata_cache.start(producers.get(DEFAULT_PRODUCER_PROFILE))
+    producers.get(CHAT_PRODUCER_PROFILE)
+
+
+@warmup.step("metadata")
+async def fetch_metadata():
+    await wait_metadata(metadata_cache)
+
+
+@warmup.step("chat-connections")
+async def connect_chat_producer():
+    # Chat sends are latency-sensitive: have their producer's broker connections up front
+    await asyncio.to_thread(producers.get(CHAT_PRODUCER_PROFILE).list_topics,
+                            timeout=WARMUP_TIMEOUT)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start Kafka warm-up without waiting for it; flush producers on shutdown."""
+    print("🚀 Starting Kafka Producer API Server...")
+    warmup.start()
     try:
-        if producer:
-            # Try to get metadata to check connection
-            metadata = producer.list_topics(timeout=5)
-            return True
-    except Exception as e:
-        print(f"Kafka connection check failed: {e}")
-    return False
+        yield
+    finally:
+        await warmup.stop()
+        # Joining the refresher and flushing block; keep the loop serving meanwhile
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, metadata_cache.stop)
+        await loop.run_in_executor(None, producers.close)
+        print("🔚 Producer API Server shutdown")
 
 
 # Create FastAPI app
 app = FastAPI(
     title="Kafka Producer API",
     description="HTTP API for producing messages to Kafka topics",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -100,37 +747,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Idempotent-Replayed", "Retry-After"],
 )
 
+# Per-endpoint latency histograms for /metrics
+app.add_middleware(RequestMetricsMiddleware, histogram=REQUEST_LATENCY)
+
 # Templates for HTML pages
 templates = Jinja2Templates(directory="producers/templates")
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize the Kafka producer on startup."""
-    global producer
-    print("🚀 Starting Kafka Producer API Server...")
-    producer = create_producer()
-    print("✅ Producer initialized")
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Clean up the Kafka producer on shutdown."""
-    global producer
-    if producer:
-        producer.flush()
-        print("🔚 Producer API Server shutdown")
-
-
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     """Serve the producer web interface."""
     return templates.TemplateResponse("producer.html", {"request": request})
 
 
-@app.get("/api", response_model=Dict[str, str])
+@app.get("/api", response_model=Dict[str, Any])
 async def api_info():
     """API information endpoint."""
     return {
@@ -138,8 +771,14 @@ async def api_info():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "ready": "/ready",
             "produce": "/produce",
             "produce in batch": "/produce/batch",
+            "produce stream (NDJSON)": "/produce/stream",
+            "produce raw": "/produce/raw",
+            "queue stats": "/producer/queue",
+            "producer profiles": "/producer/profiles",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -152,157 +791,324 @@ async def health_check():
     return HealthResponse(
         status="healthy" if kafka_connected else "unhealthy",
         timestamp=datetime.now().isoformat(),
-        kafka_connected=kafka_connected
+        kafka_connected=kafka_connected,
+        metadata_age_seconds=metadata_cache.age,
+        last_metadata_refresh=metadata_cache.last_refresh_iso()
+    )
+
+
+@app.get("/ready")
+async def readiness():
+    """200 once the Kafka clients are warmed up, 503 until then (for load balancers and probes)."""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: request/ack latency, backpressure and librdkafka statistics."""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/producer/queue", response_model=QueueStatsResponse)
+async def producer_queue_stats():
+    """In-flight queue depth and backpressure rejection counters."""
+    return QueueStatsResponse(
+        in_flight_messages=in_flight.messages,
+        in_flight_bytes=in_flight.bytes,
+        max_in_flight_messages=in_flight.max_messages,
+        max_in_flight_bytes=in_flight.max_bytes,
+        librdkafka_queue_length=producers.queue_length(),
+        waiting_requests=in_flight.waiting,
+        rejected_in_flight_limit=in_flight.rejected,
+        rejected_buffer_full=in_flight.buffer_full
     )
 
 
+@app.get("/producer/profiles")
+async def producer_profiles():
+    """Tuning profiles, endpoint/topic mappings and the instances currently running."""
+    return {
+        "profiles": PRODUCER_PROFILES,
+        "default_profile": DEFAULT_PRODUCER_PROFILE,
+        "endpoint_profiles": {
+            "/chat/send": CHAT_PRODUCER_PROFILE,
+            "/produce/batch": BULK_PRODUCER_PROFILE,
+            "/produce/stream": BULK_PRODUCER_PROFILE,
+        },
+        "topic_profiles": TOPIC_PROFILES,
+        "active_producers": {
+            profile: len(kafka_producer) for profile, kafka_producer in producers.producers.items()
+        }
+    }
+
+
+# Optional admission wait: reject immediately by default, or wait up to a deadline
+QueueWaitMs = Query(0, ge=0, description="Max milliseconds to wait for in-flight capacity")
+# Optional client retry key: repeats within the TTL return the first result
+IdempotencyKey = Header(None, max_length=255,
+                        description="Retry key; repeats return the original result without producing")
+
+
 @app.post("/produce", response_model=MessageResponse)
-async def produce_message(request: MessageRequest):
+async def produce_message(
+    request: MessageRequest,
+    response: Response,
+    queue_wait_ms: int = QueueWaitMs,
+    idempotency_key: Optional[str] = IdempotencyKey
+):
     """Produce a message to Kafka topic."""
-    global producer
-    
-    if not producer:
-        raise HTTPException(status_code=500, detail="Producer not initialized")
-    
-    try:
-        # Add metadata to the message
-        enhanced_message = {
-            **request.message,
-            "timestamp": datetime.now().isoformat(),
-            "source": "python-producer-api",
-            "server_time": time.time()
-        }
+    async def send():
+        # Add metadata to the message and encode it
+        message = stamp_message(request.message)
+        value = value_codec.encode(message)
         
-        # Convert to JSON string
-        message_str = json.dumps(enhanced_message)
-        
-        # Produce the message
-        producer.produce(
+        # Produce the message and wait for the broker ack
+        delivered = await produce_async(
             topic=request.topic,
             key=request.key.encode('utf-8') if request.key else None,
-            value=message_str.encode('utf-8'),
-            callback=delivery_report,
-            partition=request.partition
+            value=value,
+            partition=request.partition,
+            max_wait=queue_wait_seconds(queue_wait_ms),
+            headers=message_headers(message)
         )
         
-        # Flush to ensure message is sent
-        producer.flush()
-        
-        # For demo purposes, we'll return a mock response
-        # In a real implementation, you'd track the actual delivery
         return MessageResponse(
             success=True,
             message="Message sent successfully",
-            topic=request.topic,
-            partition=request.partition or 0,
-            offset=0,  # Would be actual offset in real implementation
+            topic=delivered.topic(),
+            partition=delivered.partition(),
+            offset=delivered.offset(),
             timestamp=datetime.now().isoformat()
         )
+    
+    try:
+        return await idempotent(response, "/produce", idempotency_key, send)
         
+    except BackpressureError as e:
+        raise backpressure_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to produce message: {str(e)}")
 
 
 @app.post("/produce/batch")
-async def produce_batch_messages(messages: list[MessageRequest]):
+async def produce_batch_messages(messages: list[MessageRequest], queue_wait_ms: int = QueueWaitMs):
     """Produce multiple messages in batch."""
-    global producer
-    
-    if not producer:
-        raise HTTPException(status_code=500, detail="Producer not initialized")
-    
-    results = []
-    
     try:
+        loop = asyncio.get_running_loop()
+        max_wait = queue_wait_seconds(queue_wait_ms)
+        futures = []
         for request in messages:
-            enhanced_message = {
-                **request.message,
-                "timestamp": datetime.now().isoformat(),
-                "source": "python-producer-api",
-                "server_time": time.time()
-            }
-            
-            message_str = json.dumps(enhanced_message)
+            message = stamp_message(request.message)
+            value = value_codec.encode(message)
             
-            producer.produce(
-                topic=request.topic,
-                key=request.key.encode('utf-8') if request.key else None,
-                value=message_str.encode('utf-8'),
-                callback=delivery_report,
-                partition=request.partition
-            )
-            
-            results.append({
-                "success": True,
-                "topic": request.topic,
-                "message": "Queued for delivery"
-            })
+            try:
+                futures.append(await enqueue_message(
+                    topic=request.topic,
+                    key=request.key.encode('utf-8') if request.key else None,
+                    value=value,
+                    partition=request.partition,
+                    max_wait=max_wait,
+                    profile=BULK_PRODUCER_PROFILE,
+                    headers=message_headers(message)
+                ))
+            except BackpressureError as e:
+                # Earlier messages are already queued; report this one as rejected
+                rejected = loop.create_future()
+                rejected.set_exception(e)
+                futures.append(rejected)
+        
+        # Wait for every delivery report; failures are reported per message
+        deliveries = await asyncio.gather(*futures, return_exceptions=True)
+        if deliveries and all(isinstance(d, BackpressureError) for d in deliveries):
+            raise deliveries[0]
         
-        # Flush all messages
-        producer.flush()
+        results = []
+        for request, delivered in zip(messages, deliveries):
+            if isinstance(delivered, BackpressureError):
+                results.append({
+                    "success": False,
+                    "topic": request.topic,
+                    "message": f"Rejected: {delivered}"
+                })
+            elif isinstance(delivered, Exception):
+                results.append({
+                    "success": False,
+                    "topic": request.topic,
+                    "message": f"Delivery failed: {delivered}"
+                })
+            else:
+                results.append({
+                    "success": True,
+                    "topic": delivered.topic(),
+                    "partition": delivered.partition(),
+                    "offset": delivered.offset(),
+                    "message": "Delivered"
+                })
         
+        messages_sent = sum(1 for r in results if r["success"])
         return {
-            "success": True,
-            "messages_sent": len(results),
+            "success": messages_sent == len(results),
+            "messages_sent": messages_sent,
             "results": results
         }
         
+    except BackpressureError as e:
+        raise backpressure_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to produce batch messages: {str(e)}")
 
 
-@app.post("/chat/send")
-async def send_chat_message(request: ChatMessageRequest):
-    """Send a chat message to the anonymous-anime-universe topic."""
-    global producer
+@app.post("/produce/stream")
+async def produce_stream_messages(
+    request: Request,
+    topic: str = Query("test-topic", description="Topic for records that do not set one"),
+    queue_wait_ms: int = Query(MAX_QUEUE_WAIT_MS, ge=0,
+                               description="Max milliseconds to wait for in-flight capacity per record")
+):
+    """
+    Produce newline-delimited JSON records as the request body streams in.
+
+    Each line has the same shape as a /produce request. Records are produced
+    as soon as they are parsed, and the response is a compact summary rather
+    than a per-message echo.
+    """
+    summary = StreamIngestSummary()
+    max_wait = queue_wait_seconds(queue_wait_ms)
     
-    if not producer:
-        raise HTTPException(status_code=500, detail="Producer not initialized")
+    async for line_no, line in iter_ndjson_lines(request):
+        summary.lines += 1
+        if line is None:
+            summary.error(line_no, f"Line exceeds {STREAM_MAX_LINE_BYTES} bytes")
+            continue
+        try:
+            record_topic, key, message, partition = parse_ndjson_record(line, topic)
+        except ValueError as e:
+            summary.error(line_no, f"Invalid record: {e}")
+            continue
+        
+        try:
+            stamp_message(message)
+            future = await enqueue_message(
+                topic=record_topic,
+                key=key.encode('utf-8') if key else None,
+                value=value_codec.encode(message),
+                partition=partition,
+                max_wait=max_wait,
+                profile=BULK_PRODUCER_PROFILE,
+                headers=message_headers(message)
+            )
+        except BackpressureError as e:
+            summary.error(line_no, f"Rejected: {e}")
+            continue
+        except Exception as e:
+            summary.error(line_no, f"Failed to produce: {e}")
+            continue
+        summary.track(line_no, future)
+    
+    await summary.wait_delivered()
+    return summary.to_dict()
+
+
+@app.post("/produce/raw", response_model=MessageResponse)
+async def produce_raw_message(
+    request: Request,
+    response: Response,
+    topic: str = Query("test-topic"),
+    key: Optional[str] = Query(None),
+    partition: Optional[int] = Query(None),
+    queue_wait_ms: int = QueueWaitMs,
+    idempotency_key: Optional[str] = IdempotencyKey
+):
+    """
+    Produce the request body verbatim (raw passthrough).
+
+    The body is neither parsed nor re-serialized, so clients that already
+    hold encoded records (JSON, msgpack, ...) skip a decode/encode round trip.
+    """
+    content_type = request.headers.get("content-type")
+    if codec_for_content_type(content_type) is None:
+        raise HTTPException(status_code=415, detail="Unsupported Content-Type for raw produce")
+    
+    async def send():
+        # The body is never parsed, so the record carries no type header
+        delivered = await produce_async(
+            topic=topic,
+            key=key.encode('utf-8') if key else None,
+            value=await request.body(),
+            partition=partition,
+            max_wait=queue_wait_seconds(queue_wait_ms),
+            headers=build_headers(None, content_type.split(";", 1)[0].strip().lower())
+        )
+        
+        return MessageResponse(
+            success=True,
+            message="Message sent successfully",
+            topic=delivered.topic(),
+            partition=delivered.partition(),
+            offset=delivered.offset(),
+            timestamp=datetime.now().isoformat()
+        )
     
     try:
+        return await idempotent(response, "/produce/raw", idempotency_key, send)
+        
+    except BackpressureError as e:
+        raise backpressure_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to produce message: {str(e)}")
+
+
+@app.post("/chat/send")
+async def send_chat_message(
+    request: ChatMessageRequest,
+    response: Response,
+    queue_wait_ms: int = QueueWaitMs,
+    idempotency_key: Optional[str] = IdempotencyKey
+):
+    """Send a chat message to the anonymous-anime-universe topic."""
+    async def send():
         # Create chat message structure
         chat_message = {
             "username": request.username,
             "text": request.text,
             "room": request.room,
             "timestamp": datetime.now().isoformat(),
-            "message_id": f"msg_{int(time.time() * 1000)}",
+            "message_id": f"msg_{message_ids.next_id()}",
             "type": "chat_message"
         }
         
-        # Convert to JSON string
-        message_str = json.dumps(chat_message)
-        
-        # Produce the message to the chat topic
-        producer.produce(
+        # Produce the message to the chat topic and wait for the broker ack
+        delivered = await produce_async(
             topic=request.room,
             key=request.username.encode('utf-8'),
-            value=message_str.encode('utf-8'),
-            callback=delivery_report
+            value=value_codec.encode(chat_message),
+            max_wait=queue_wait_seconds(queue_wait_ms),
+            profile=CHAT_PRODUCER_PROFILE,
+            headers=build_headers("chat_message", value_codec.content_type)
         )
         
-        # Flush to ensure message is sent
-        producer.flush()
-        
         return {
             "success": True,
             "message": "Chat message sent successfully",
             "message_id": chat_message["message_id"],
+            "partition": delivered.partition(),
+            "offset": delivered.offset(),
             "timestamp": chat_message["timestamp"]
         }
+    
+    try:
+        return await idempotent(response, "/chat/send", idempotency_key, send)
         
+    except BackpressureError as e:
+        raise backpressure_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send chat message: {str(e)}")
 
 
 @app.post("/produce-simple")
-async def produce_simple_message(request: Request):
+async def produce_simple_message(request: Request, queue_wait_ms: int = QueueWaitMs):
     """Simple endpoint for web form submissions."""
-    global producer
-    
-    if not producer:
-        raise HTTPException(status_code=500, detail="Producer not initialized")
-    
     try:
         form_data = await request.form()
         topic = form_data.get("topic", "test-topic")
@@ -317,21 +1123,24 @@ async def produce_simple_message(request: Request):
             "user_input": True
         }
         
-        message_str = json.dumps(message)
-        
-        # Produce the message
-        producer.produce(
+        # Produce the message and wait for the broker ack
+        delivered = await produce_async(
             topic=topic,
             key=key.encode('utf-8') if key else None,
-            value=message_str.encode('utf-8'),
-            callback=delivery_report
+            value=value_codec.encode(message),
+            max_wait=queue_wait_seconds(queue_wait_ms),
+            headers=build_headers(None, value_codec.content_type)
         )
         
-        # Flush to ensure message is sent
-        producer.flush()
-        
-        return {"success": True, "message": "Message sent successfully!"}
+        return {
+            "success": True,
+            "message": "Message sent successfully!",
+            "partition": delivered.partition(),
+            "offset": delivered.offset()
+        }
         
+    except BackpressureError as e:
+        raise backpressure_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
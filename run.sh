@@ -5,13 +5,9 @@
 
 echo "🚀 Starting Kafka Playground with Python..."
 
-# Build and start all services
+# Build and start all services; --wait returns once the API servers report ready
 echo "📦 Building and starting services..."
-docker compose up --build -d
-
-# Wait for services to be ready
-echo "⏳ Waiting for services to be ready..."
-sleep 60
+docker compose up --build -d --wait
 
 # Show status
 echo "🔍 Service status:"